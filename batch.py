@@ -0,0 +1,158 @@
+"""
+Runs a file of prompts through the conversation engine without the UI.
+
+    python batch.py prompts.jsonl --output results.jsonl --concurrency 4
+
+Every line of the input is a JSON object with a "prompt" and optionally an "id", "files" (paths of
+attachments), "model" and "options". Each prompt is answered in a chat of its own, nothing is saved to the
+chat folder. Results are written to the output as they complete, one JSON object per line with the id,
+model, answer, metrics and error. A throughput report is printed at the end.
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+
+from bot import client
+from bot.events import ChatEvents
+from bot.metrics import percentile
+from bot.ollama_integration import OllamaCall
+from bot.scheduler import configure_scheduler, DEFAULT_SLOTS
+from utils.ingestion import ingestion_pipeline
+
+
+class FileErrors(ChatEvents):
+    # Collects the attachments of one prompt that couldn't be read
+    def __init__(self):
+        self.errors = {}
+
+    def file_processed(self, file_path, error):
+        if error is not None:
+            self.errors[file_path] = str(error)
+
+
+async def answer(request, line_number, args):
+    result = {"id": request.get("id", line_number), "model": request.get("model", args.model)}
+    parts = []
+    chatbot = None
+    try:
+        chatbot = OllamaCall(result["model"], use_retrieval=args.retrieval, user_id="batch",
+                             options=request.get("options"), persist=False)
+        file_errors = FileErrors()
+        chatbot.subscribe(file_errors)
+        chatbot.upload_files(request.get("files", []))
+        await chatbot.wait_for_files()
+        if file_errors.errors:
+            # An answer without the attachment would look valid, so the prompt isn't sent
+            error = "; ".join(f"{path}: {error}" for path, error in file_errors.errors.items())
+            return {**result, "answer": None, "metrics": None, "error": error}
+        async for part in chatbot.send_message(request["prompt"]):
+            parts.append(part)
+        result.update({"answer": "".join(parts), "metrics": chatbot.last_metrics, "error": None})
+    except Exception as e:
+        # Any failure is reported on the prompt's line, the other prompts go on
+        result.update({"answer": "".join(parts), "metrics": chatbot.last_metrics if chatbot else None,
+                       "error": str(e) or type(e).__name__})
+    return result
+
+
+def parse_request(line):
+    request = json.loads(line)
+    if not isinstance(request, dict) or not isinstance(request.get("prompt"), str):
+        raise ValueError("expected an object with a \"prompt\" string")
+    if not isinstance(request.get("options", {}), dict):
+        raise ValueError("\"options\" must be an object")
+    files = request.get("files", [])
+    if not isinstance(files, list) or not all(isinstance(path, str) for path in files):
+        raise ValueError("\"files\" must be a list of paths")
+    if not isinstance(request.get("model", ""), str):
+        raise ValueError("\"model\" must be a string")
+    return request
+
+
+async def run_batch(args):
+    # At most `concurrency` prompts are in flight, the scheduler gets as many slots so nothing waits there
+    configure_scheduler(slots=args.concurrency, max_queue=args.concurrency, max_queue_per_user=args.concurrency)
+    in_flight = asyncio.Semaphore(args.concurrency)
+    results = []
+    tasks = set()
+
+    with open(args.output, "w", encoding="utf-8") as output:
+        def write(result):
+            results.append(result)
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+
+        async def run(request, line_number):
+            try:
+                write(await answer(request, line_number, args))
+            finally:
+                in_flight.release()
+
+        started = time.perf_counter()
+        with open(args.input, "r", encoding="utf-8") as prompts:
+            # Read line by line, a large input isn't loaded at once
+            for line_number, line in enumerate(prompts, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    request = parse_request(line)
+                except ValueError as e:
+                    write({"id": line_number, "model": args.model, "answer": None, "metrics": None,
+                           "error": f"Invalid request: {e}"})
+                    continue
+                await in_flight.acquire()
+                task = asyncio.create_task(run(request, line_number))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            # A failing prompt must not cancel the others, its error is already on its line
+            await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+    return results, elapsed
+
+
+def report(results, elapsed):
+    """
+    Throughput of the run: prompts and generated tokens per second over the wall-clock time, and the
+    distribution of the time to first token.
+    """
+    succeeded = [result for result in results if not result["error"]]
+    metrics = [result["metrics"] for result in succeeded if result["metrics"]]
+    tokens = sum(m.get("eval_tokens", 0) for m in metrics)
+    ttfts = sorted(m["ttft_ms"] for m in metrics if m.get("ttft_ms") is not None)
+    return {
+        "prompts": len(results),
+        "failed": len(results) - len(succeeded),
+        "elapsed_s": round(elapsed, 2),
+        "prompts_per_s": round(len(results) / elapsed, 2) if elapsed else None,
+        "generated_tokens": tokens,
+        "tokens_per_s": round(tokens / elapsed, 1) if elapsed else None,
+        "ttft_p50_ms": percentile(ttfts, 0.5),
+        "ttft_p95_ms": percentile(ttfts, 0.95),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of prompts with Ollama, without the UI")
+    parser.add_argument("input", help="JSONL file with one {\"prompt\", \"id\", \"files\", \"model\", \"options\"} per line")
+    parser.add_argument("--output", default="results.jsonl", help="JSONL file for the answers")
+    parser.add_argument("--model", default="llama3.2:latest", help="model for prompts that don't name one")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_SLOTS,
+                        help="prompts answered at the same time, should match OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--retrieval", action="store_true", help="send only the relevant parts of attachments")
+    parser.add_argument("--host", default=None, help="Ollama address, OLLAMA_HOST by default")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    if args.host:
+        client.configure(host=args.host)
+    results, elapsed = asyncio.run(run_batch(args))
+    ingestion_pipeline.shutdown()
+    print(json.dumps(report(results, elapsed), indent=2), file=sys.stderr)
+    return 1 if results and all(result["error"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
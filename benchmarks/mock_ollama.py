@@ -0,0 +1,159 @@
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockOllama:
+    """
+    Local stand-in for the Ollama HTTP API. /api/chat and /api/generate stream `tokens` synthetic tokens
+    of `token_size` characters at `rate` tokens per second after `first_token_delay` seconds, and end with
+    a final chunk carrying counters and durations like Ollama's. The other endpoints the app uses answer
+    immediately. Settings can be changed between requests with configure().
+
+        with MockOllama(rate=200, tokens=256) as server:
+            client.configure(host=server.url)
+    """
+
+    def __init__(self, port=0, rate=100.0, tokens=128, token_size=4, first_token_delay=0.0, models=("llama3.2:latest",)):
+        self.rate = rate
+        self.tokens = tokens
+        self.token_size = token_size
+        self.first_token_delay = first_token_delay
+        self.models = list(models)
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def configure(self, **settings):
+        for name, value in settings.items():
+            if not hasattr(self, name):
+                raise AttributeError(f"Unknown setting '{name}'")
+            setattr(self, name, value)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def model_list(self):
+        return {"models": [{
+            "name": name, "model": name, "size": 2_000_000_000, "digest": f"mock-{name}",
+            "details": {"family": "llama", "parameter_size": "3.2B", "quantization_level": "Q4_K_M"},
+        } for name in self.models]}
+
+    def final_chunk(self, prompt_tokens, eval_count, eval_seconds, total_seconds):
+        return {
+            "done": True, "done_reason": "stop",
+            "prompt_eval_count": prompt_tokens, "prompt_eval_duration": int(self.first_token_delay * 1e9),
+            "eval_count": eval_count, "eval_duration": int(eval_seconds * 1e9),
+            "load_duration": 0, "total_duration": int(total_seconds * 1e9),
+        }
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, body):
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_chunk(self, body):
+                line = json.dumps(body).encode() + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self.send_json(mock.model_list())
+                elif self.path == "/api/ps":
+                    self.send_json({"models": []})
+                else:
+                    self.send_json({"version": "0.0.0-mock"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                mock.requests += 1
+                if self.path in ("/api/chat", "/api/generate"):
+                    self.generate(request, chat=self.path == "/api/chat")
+                elif self.path == "/api/embed":
+                    inputs = request.get("input", [])
+                    inputs = inputs if isinstance(inputs, list) else [inputs]
+                    # Deterministic 8-dimensional vectors derived from the text
+                    self.send_json({"embeddings": [[float((len(text) * (i + 1)) % 17) + 1.0 for i in range(8)]
+                                                   for text in inputs]})
+                elif self.path == "/api/show":
+                    self.send_json({"details": {"family": "llama", "parameter_size": "3.2B", "quantization_level": "Q4_K_M"},
+                                    "model_info": {"llama.context_length": 131072}})
+                else:
+                    self.send_json({"status": "success"})
+
+            def generate(self, request, chat):
+                messages = request.get("messages") or [{"content": request.get("prompt", "")}]
+                # Roughly 4 characters per token, like the usual estimate for English text
+                prompt_tokens = sum(len(message.get("content", "")) for message in messages) // 4
+                token = "x" * (mock.token_size - 1) + " "
+
+                def chunk(content, done=False):
+                    body = {"model": request.get("model"), "done": done}
+                    if chat:
+                        body["message"] = {"role": "assistant", "content": content}
+                    else:
+                        body["response"] = content
+                    return body
+
+                start = time.perf_counter()
+                if not request.get("stream", True):
+                    body = chunk(token * mock.tokens, done=True)
+                    body.update(mock.final_chunk(prompt_tokens, mock.tokens, 0.0, 0.0))
+                    return self.send_json(body)
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    time.sleep(mock.first_token_delay)
+                    first_token = time.perf_counter()
+                    for i in range(mock.tokens):
+                        # Tokens follow a fixed schedule, so the rate holds even if single sleeps overshoot
+                        delay = first_token + i / mock.rate - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                        self.send_chunk(chunk(token))
+                    end = time.perf_counter()
+                    final = chunk("", done=True)
+                    final.update(mock.final_chunk(prompt_tokens, mock.tokens, end - first_token, end - start))
+                    self.send_chunk(final)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped the stream
+                    pass
+
+        return Handler
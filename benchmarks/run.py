@@ -0,0 +1,246 @@
+"""
+Benchmarks of the app's own overhead, separate from model speed. Ollama is replaced by a local mock server
+(benchmarks/mock_ollama.py) that streams synthetic tokens at a fixed rate, so what is left in the numbers
+is the time spent in this code. Everything runs in a temporary working directory.
+
+    python -m benchmarks.run --output bench.json
+    python -m benchmarks.run --quick --only send_message,create_message
+
+The JSON file holds the environment (commit, Python, platform) and one entry per benchmark and parameter
+set, with the timings in ms, so results of two commits can be compared.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.mock_ollama import MockOllama
+from bot import client
+from bot.metrics import percentile
+from bot.ollama_integration import OllamaCall
+from utils import utils
+from utils.chat_store import get_store
+from utils.pdf_cache import extraction_cache
+from ui.chat_sidebar import PAGE_SIZE
+
+# Parameters of the full run, --quick uses the first entries only
+RATES = (100, 1000)
+STREAM_TOKENS = 256
+HISTORY_LENGTHS = (10, 100, 1000, 5000)
+PDF_PAGES = (10, 100, 500)
+TRANSCRIPT_LENGTHS = (100, 1000, 10000)
+CHAT_COUNTS = (1000, 5000)
+
+
+def stats(name, params, samples, **extra):
+    # samples in seconds
+    samples_ms = sorted(sample * 1000 for sample in samples)
+    return {
+        "name": name,
+        "params": params,
+        "runs": len(samples_ms),
+        "mean_ms": round(sum(samples_ms) / len(samples_ms), 3),
+        "p50_ms": percentile(samples_ms, 0.5, digits=3),
+        "p95_ms": percentile(samples_ms, 0.95, digits=3),
+        "min_ms": round(samples_ms[0], 3),
+        **extra,
+    }
+
+
+def measure(function, repeat, warmup=1):
+    for _ in range(warmup):
+        function()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def new_chatbot(chat_folder):
+    # No listeners, the benchmarks only measure the engine and the storage
+    return OllamaCall("llama3.2:latest", chat_folder=chat_folder)
+
+
+def synthetic_messages(count, size=400):
+    text = ("lorem ipsum dolor sit amet " * (size // 27 + 1))[:size]
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": f"{i} {text}"} for i in range(count)]
+
+
+def bench_send_message(server, quick):
+    """
+    Full path of one answer: prompt building, scheduler, streaming, saving. overhead_ms is the time on
+    top of what the mock server needs to stream the tokens.
+    """
+    results = []
+    for rate in RATES[:1] if quick else RATES:
+        server.configure(rate=rate, tokens=STREAM_TOKENS, first_token_delay=0.0)
+        expected = (STREAM_TOKENS - 1) / rate
+        totals, ttfts = [], []
+
+        async def answer():
+            chatbot = new_chatbot("chats_send")
+            start = time.perf_counter()
+            async for _ in chatbot.send_message("Benchmark prompt"):
+                pass
+            totals.append(time.perf_counter() - start)
+            ttfts.append(chatbot.last_metrics["ttft_ms"] / 1000)
+
+        for _ in range(3 if quick else 10):
+            asyncio.run(answer())
+        result = stats("send_message", {"rate": rate, "tokens": STREAM_TOKENS}, totals,
+                       ttft_p50_ms=percentile(sorted(t * 1000 for t in ttfts), 0.5, digits=3))
+        result["overhead_ms"] = round(result["p50_ms"] - expected * 1000, 3)
+        results.append(result)
+    return results
+
+
+def bench_create_message(server, quick):
+    results = []
+    for length in HISTORY_LENGTHS[:2] if quick else HISTORY_LENGTHS:
+        chatbot = new_chatbot("chats_create")
+        chatbot.current_chat = synthetic_messages(length)
+        # One attached document of about 20 KB, its context is built once and then cached
+        document = extraction_cache.put_pages("document-hash", ["page text " * 200] * 10)
+        chatbot.add_processed_file("document.pdf", "document-hash", document)
+        samples = measure(lambda: chatbot.create_message("Next question"), repeat=20 if quick else 100)
+        results.append(stats("create_message", {"history": length}, samples))
+    return results
+
+
+def generate_pdf(path, pages):
+    # PyMuPDF is only needed here, like in the app it's imported on first use
+    import fitz
+    line = "The quick brown fox jumps over the lazy dog. " * 2
+    with fitz.open() as pdf:
+        for page_num in range(pages):
+            page = pdf.new_page()
+            page.insert_text((50, 50), "\n".join(f"{page_num}.{i} {line}" for i in range(40)), fontsize=8)
+        pdf.save(path)
+
+
+def bench_read_pdf(server, quick):
+    results = []
+    for pages in PDF_PAGES[:2] if quick else PDF_PAGES:
+        path = os.path.abspath(f"bench_{pages}.pdf")
+        generate_pdf(path, pages)
+        params = {"pages": pages, "bytes": os.path.getsize(path)}
+        repeat = 2 if quick else 5
+        results.append(stats("read_PDF", params, measure(lambda: utils.read_PDF(path), repeat)))
+
+        def cold():
+            extraction_cache._index = None
+            if os.path.exists(extraction_cache.cache_dir):
+                for file_name in os.listdir(extraction_cache.cache_dir):
+                    os.remove(os.path.join(extraction_cache.cache_dir, file_name))
+            utils.read_document_cached(path, None)
+
+        results.append(stats("read_document_cached.cold", params, measure(cold, repeat, warmup=0)))
+        results.append(stats("read_document_cached.warm", params,
+                             measure(lambda: utils.read_document_cached(path, None), repeat * 4)))
+    return results
+
+
+def bench_transcripts(server, quick):
+    results = []
+    store = get_store("chats_transcripts")
+    for length in TRANSCRIPT_LENGTHS[:2] if quick else TRANSCRIPT_LENGTHS:
+        name = f"transcript {length}"
+        store.append_messages(name, synthetic_messages(length))
+        params = {"messages": length}
+        repeat = 5 if quick else 20
+        results.append(stats("load_chat_file", params,
+                             measure(lambda: utils.load_chat_file(name, "chats_transcripts"), repeat)))
+        results.append(stats("format_chat_content", params,
+                             measure(lambda: utils.format_chat_content(name, "chats_transcripts"), repeat)))
+    return results
+
+
+def bench_sidebar(server, quick):
+    """
+    Opening a folder of old .txt chats (one-shot migration), then the sidebar's first page and the full list.
+    """
+    results = []
+    for count in CHAT_COUNTS[:1] if quick else CHAT_COUNTS:
+        chat_folder = f"chats_sidebar_{count}"
+        os.makedirs(chat_folder)
+        for i in range(count):
+            with open(os.path.join(chat_folder, f"chat {i}.txt"), "w", encoding="utf-8") as file:
+                file.write(f"user: question {i}\nassistant: answer {i}\nwith a second line\n")
+        params = {"chats": count}
+        start = time.perf_counter()
+        get_store(chat_folder)
+        results.append(stats("migrate_txt_chats", params, [time.perf_counter() - start]))
+        repeat = 10 if quick else 50
+        results.append(stats("sidebar.first_page", params,
+                             measure(lambda: utils.load_chat_entries(0, PAGE_SIZE, chat_folder), repeat)))
+        results.append(stats("sidebar.all_chats", params,
+                             measure(lambda: utils.load_chat_files(chat_folder), repeat)))
+    return results
+
+
+BENCHMARKS = {
+    "send_message": bench_send_message,
+    "create_message": bench_create_message,
+    "read_pdf": bench_read_pdf,
+    "transcripts": bench_transcripts,
+    "sidebar": bench_sidebar,
+}
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OllamaUI benchmarks against a mock Ollama server")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON file for the results")
+    parser.add_argument("--quick", action="store_true", help="smaller sizes and fewer runs")
+    parser.add_argument("--only", default=None, help=f"comma separated subset of {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    output = os.path.abspath(args.output)
+
+    results = []
+    with MockOllama() as server, tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as workdir:
+        client.configure(host=server.url)
+        # Chats, caches and the metrics log are written relative to the working directory
+        os.chdir(workdir)
+        for name in names:
+            print(f"Running {name}...", flush=True)
+            for result in BENCHMARKS[name](server, args.quick):
+                print(f"  {result['name']} {result['params']}: p50 {result['p50_ms']} ms", flush=True)
+                results.append(result)
+        os.chdir(REPO_ROOT)
+
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump({"environment": environment(), "quick": args.quick, "results": results}, file, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,217 @@
+import os
+import queue
+import asyncio
+import threading
+
+import httpx
+import ollama
+
+# Single place to configure how the app talks to Ollama. OLLAMA_HOST is also read by the ollama package.
+OLLAMA_HOST = os.getenv("OLLAMA_HOST")
+CONNECT_TIMEOUT = 5.0
+# Generous read timeout, a model can take a while to load before the first token arrives
+READ_TIMEOUT = 600.0
+MAX_CONNECTIONS = 16
+MAX_KEEPALIVE_CONNECTIONS = 8
+KEEPALIVE_EXPIRY = 120.0
+
+_DONE = object()
+
+
+class OllamaClient:
+    """
+    One long-lived ollama.AsyncClient with a keep-alive connection pool, running on its own event loop
+    thread. `aio` and `sync` expose the same API for coroutines and plain code; both go through this one
+    pool, no matter which thread or event loop they are called from.
+    """
+
+    def __init__(self, host=OLLAMA_HOST, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=KEEPALIVE_EXPIRY):
+        self.host = host
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="ollama-client", daemon=True)
+        self._thread.start()
+
+        async def create_client():
+            # httpx async clients are bound to the loop they are used on
+            return ollama.AsyncClient(
+                host,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=max_connections,
+                                    max_keepalive_connections=max_keepalive_connections,
+                                    keepalive_expiry=keepalive_expiry),
+            )
+
+        self._client = self.submit(create_client()).result()
+        self.aio = AsyncFacade(self)
+        self.sync = SyncFacade(self)
+
+    def submit(self, coro):
+        # Runs a coroutine on the client loop, returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def call(self, method, *args, **kwargs):
+        return self.submit(getattr(self._client, method)(*args, **kwargs))
+
+    def stream(self, method, put, *args, **kwargs):
+        """
+        Runs a streaming call on the client loop and passes every part to put(), followed by _DONE or the
+        exception. Cancelling the returned future closes the HTTP response, so Ollama stops generating.
+        """
+        async def produce():
+            try:
+                async for part in await getattr(self._client, method)(*args, stream=True, **kwargs):
+                    put(part)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                put(e)
+                return
+            put(_DONE)
+
+        return self.submit(produce())
+
+    def close(self):
+        self.submit(self._client._client.aclose()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+class AsyncFacade:
+    """
+    Coroutine API, usable from any event loop (e.g. the one of a Flet handler).
+    """
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    async def _call(self, method, *args, **kwargs):
+        return await asyncio.wrap_future(self._owner.call(method, *args, **kwargs))
+
+    async def _stream(self, method, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        parts = asyncio.Queue()
+        future = self._owner.stream(method, lambda part: loop.call_soon_threadsafe(parts.put_nowait, part),
+                                    *args, **kwargs)
+        try:
+            while True:
+                part = await parts.get()
+                if part is _DONE:
+                    break
+                if isinstance(part, Exception):
+                    raise part
+                yield part
+        finally:
+            # Stops the request if the consumer stops early
+            future.cancel()
+
+    async def chat(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("chat", *args, **kwargs)
+        return await self._call("chat", *args, **kwargs)
+
+    async def generate(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("generate", *args, **kwargs)
+        return await self._call("generate", *args, **kwargs)
+
+    async def pull(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("pull", *args, **kwargs)
+        return await self._call("pull", *args, **kwargs)
+
+    async def embed(self, *args, **kwargs):
+        return await self._call("embed", *args, **kwargs)
+
+    async def list(self):
+        return await self._call("list")
+
+    async def show(self, model):
+        return await self._call("show", model)
+
+    async def delete(self, model):
+        return await self._call("delete", model)
+
+    async def ps(self):
+        return await self._call("ps")
+
+
+class SyncFacade:
+    """
+    Blocking API for code that isn't running in an event loop. Must not be used on the client loop itself.
+    """
+
+    def __init__(self, owner):
+        self._owner = owner
+
+    def _call(self, method, *args, **kwargs):
+        return self._owner.call(method, *args, **kwargs).result()
+
+    def _stream(self, method, *args, **kwargs):
+        parts = queue.Queue()
+        future = self._owner.stream(method, parts.put, *args, **kwargs)
+        try:
+            while True:
+                part = parts.get()
+                if part is _DONE:
+                    break
+                if isinstance(part, Exception):
+                    raise part
+                yield part
+        finally:
+            future.cancel()
+
+    def chat(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("chat", *args, **kwargs)
+        return self._call("chat", *args, **kwargs)
+
+    def generate(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("generate", *args, **kwargs)
+        return self._call("generate", *args, **kwargs)
+
+    def pull(self, *args, stream=False, **kwargs):
+        if stream:
+            return self._stream("pull", *args, **kwargs)
+        return self._call("pull", *args, **kwargs)
+
+    def embed(self, *args, **kwargs):
+        return self._call("embed", *args, **kwargs)
+
+    def list(self):
+        return self._call("list")
+
+    def show(self, model):
+        return self._call("show", model)
+
+    def delete(self, model):
+        return self._call("delete", model)
+
+    def ps(self):
+        return self._call("ps")
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    # The client is created on first use
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = OllamaClient()
+        return _client
+
+
+def configure(**kwargs):
+    """
+    Replaces the shared client, e.g. configure(host="http://gpu-box:11434", read_timeout=120).
+    """
+    global _client
+    with _client_lock:
+        old_client, _client = _client, OllamaClient(**kwargs)
+    if old_client is not None:
+        old_client.close()
+    return _client
@@ -0,0 +1,111 @@
+import threading
+
+from bot.client import get_client
+from bot.residency import model_residency
+from bot.prompt_builder import SUMMARY_HEADER
+from bot.tokens import context_window, messages_tokens, request_options
+
+# Share of the context window the conversation history may use, the rest is left for files and the answer
+HISTORY_BUDGET_RATIO = 0.5
+# Number of most recent messages that are always sent verbatim
+KEEP_RECENT_MESSAGES = 6
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a user and an assistant. "
+    "Update the summary with the new messages below. Keep every fact, decision, name, number and open "
+    "question that later messages may refer to, drop small talk. Write at most {words} words and output "
+    "only the updated summary.\n\n"
+    "Current summary:\n{summary}\n\n"
+    "New messages:\n{messages}"
+)
+
+
+class Compactor:
+    """
+    Rolling summary of the older part of one chat. Once the history passes the token budget, the messages
+    that are neither summarized yet nor among the KEEP_RECENT_MESSAGES newest are folded into the summary
+    in a background thread, the summary is updated incrementally instead of being written from scratch.
+    view() returns what is sent: the summary and the messages after it.
+    on_update(compactor) is called from the background thread after the summary changed.
+    """
+
+    def __init__(self, summary="", summarized=0, on_update=None):
+        self.summary = summary
+        # Number of messages at the start of the chat that are covered by the summary
+        self.summarized = summarized
+        self.on_update = on_update
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def view(self, history):
+        with self._lock:
+            return self.summary, history[self.summarized:]
+
+    def history_tokens(self, history, model):
+        # Estimated like the prompt size indicator, with the model's tokenizer ratio
+        summary, recent = self.view(history)
+        if summary:
+            recent = [{'content': SUMMARY_HEADER + summary}] + recent
+        return messages_tokens(model, recent)
+
+    def over_budget(self, history, model, num_ctx=None):
+        budget = context_window(model, num_ctx) * HISTORY_BUDGET_RATIO
+        return self.history_tokens(history, model) > budget and len(history) - self.summarized > KEEP_RECENT_MESSAGES
+
+    def compact_in_background(self, history, model, num_ctx=None):
+        """
+        Starts a compaction of a snapshot of the history if it's over the budget. A compaction that is
+        already running covers the history up to its start, the next call picks up the rest.
+        num_ctx: window set in the chat's options, the budget is otherwise taken from the model's window.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._compact, args=(list(history), model, num_ctx), daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _compact(self, history, model, num_ctx=None):
+        if not self.over_budget(history, model, num_ctx):
+            return
+        budget = context_window(model, num_ctx) * HISTORY_BUDGET_RATIO
+        # The summary may use a quarter of the history budget, in words (about 0.75 words per token)
+        words = max(100, int(budget / 4 * 0.75))
+        target = len(history) - KEEP_RECENT_MESSAGES
+        # Folded in batches that fit the budget, so a long chat doesn't overflow the summarizing request
+        while self.summarized < target:
+            end = self.summarized + 1
+            while end < target and messages_tokens(model, history[self.summarized:end + 1]) <= budget:
+                end += 1
+            if not self._fold(history[self.summarized:end], end, model, words, num_ctx):
+                return
+
+    def _fold(self, messages, end, model, words, num_ctx=None):
+        prompt = SUMMARY_PROMPT.format(
+            words=words,
+            summary=self.summary or "(empty)",
+            messages="\n".join(f"{message['role']}: {message['content']}" for message in messages),
+        )
+        request = [{'role': 'user', 'content': prompt}]
+        # Sized like a chat request, in Ollama's default window the folded turns would be cut off
+        options = request_options(model, request, {'num_ctx': num_ctx} if num_ctx else None)
+        try:
+            with model_residency.in_use(model, options):
+                response = get_client().sync.chat(model=model, messages=request, options=options,
+                                                  keep_alive=model_residency.keep_alive(model))
+        except Exception:
+            # The full history is sent until a later compaction succeeds
+            return False
+        summary = response['message']['content'].strip()
+        if not summary:
+            return False
+        with self._lock:
+            self.summary = summary
+            self.summarized = end
+        if self.on_update:
+            self.on_update(self)
+        return True
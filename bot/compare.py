@@ -0,0 +1,80 @@
+import os
+import time
+import asyncio
+import threading
+
+import httpx
+import ollama
+
+from bot.client import get_client
+from bot.metrics import response_metrics, metrics_log
+from bot.scheduler import get_scheduler, QueueFull
+from bot.residency import model_residency
+
+# Number of models Ollama keeps loaded at the same time, matches the server's OLLAMA_MAX_LOADED_MODELS.
+# More models at once would evict each other and the reloads would count into the compared times.
+MAX_LOADED_MODELS = int(os.getenv("OLLAMA_MAX_LOADED_MODELS", "3"))
+
+
+async def compare(chatbot, prompt, models, on_part=None, on_status=None, max_loaded=MAX_LOADED_MODELS):
+    """
+    Sends prompt with the chat's history and attached files to every model in models and streams the
+    answers side by side. Nothing is added to the chat, an answer is taken over with chatbot.adopt_answer().
+    At most max_loaded models run at once, the others are queued; every request also waits for a slot of
+    the shared scheduler, like a normal answer.
+    on_part(model, text) is called for every streamed piece, on_status(model, status) with "waiting",
+    "running" and "done". Returns {model: {'content', 'metrics', 'error'}} in the order of models.
+    """
+    await chatbot.wait_for_files()
+    # The same messages for every model, built once
+    messages = await asyncio.to_thread(chatbot.create_message, prompt)
+    loaded = asyncio.Semaphore(max_loaded)
+
+    def status(model, value):
+        if on_status:
+            on_status(model, value)
+
+    async def run(model):
+        queued_at = time.perf_counter()
+        status(model, "waiting")
+        parts = []
+        metrics = None
+        error = None
+        try:
+            async with loaded, get_scheduler().slot(chatbot.user_id):
+                status(model, "running")
+                options = await asyncio.to_thread(chatbot.request_options, messages, model)
+                started = time.perf_counter()
+                first_token_at = None
+                final_part = None
+                model_residency.begin(model)
+                try:
+                    stream = await get_client().aio.chat(model=model, messages=messages, stream=True, options=options,
+                                                         keep_alive=model_residency.keep_alive(model))
+                    async for part in stream:
+                        if part.get('done'):
+                            final_part = part
+                        content = part.get('message', {}).get('content', '')
+                        if first_token_at is None and content:
+                            first_token_at = time.perf_counter()
+                        if content:
+                            parts.append(content)
+                            if on_part:
+                                on_part(model, content)
+                except (ollama.ResponseError, httpx.HTTPError) as e:
+                    # e.g. the model was deleted in the meantime, the other columns go on
+                    error = str(e)
+                finally:
+                    model_residency.end(model, loaded=first_token_at is not None or final_part is not None,
+                                        options=options)
+                metrics = response_metrics(model, final_part, started, first_token_at, time.perf_counter(),
+                                           (started - queued_at) * 1000)
+        except QueueFull as e:
+            error = str(e)
+        if error is None:
+            threading.Thread(target=metrics_log.record, args=(metrics,), daemon=True).start()
+        status(model, "done")
+        return {'content': "".join(parts), 'metrics': metrics, 'error': error}
+
+    results = await asyncio.gather(*(run(model) for model in models))
+    return dict(zip(models, results))
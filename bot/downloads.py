@@ -0,0 +1,171 @@
+import time
+import asyncio
+import threading
+from collections import deque
+
+import httpx
+import ollama
+
+from bot.client import get_client
+from bot.model_registry import model_registry
+
+MAX_CONCURRENT_DOWNLOADS = 2
+MAX_RETRIES = 3
+RETRY_DELAY = 2.0
+# Window for the throughput estimate, and minimum time between two progress notifications
+THROUGHPUT_WINDOW = 5.0
+NOTIFY_INTERVAL = 0.25
+
+
+class Download:
+    """
+    State of one model pull: per-layer bytes, overall percent and throughput.
+    status is one of queued, downloading, done, failed, cancelled.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.status = "queued"
+        self.status_text = "Waiting..."
+        self.layers = {}  # digest -> {"total", "completed"}
+        self.error = None
+        self.future = None
+        self._samples = deque()
+
+    @property
+    def total(self):
+        return sum(layer["total"] for layer in self.layers.values())
+
+    @property
+    def completed(self):
+        return sum(layer["completed"] for layer in self.layers.values())
+
+    @property
+    def percent(self):
+        return 100 * self.completed / self.total if self.total else 0.0
+
+    @property
+    def throughput(self):
+        # Bytes per second over the last THROUGHPUT_WINDOW seconds
+        if len(self._samples) < 2:
+            return 0.0
+        (start_time, start_bytes), (end_time, end_bytes) = self._samples[0], self._samples[-1]
+        return (end_bytes - start_bytes) / (end_time - start_time) if end_time > start_time else 0.0
+
+    @property
+    def active(self):
+        return self.status in ("queued", "downloading")
+
+    def update(self, part):
+        self.status_text = part.get("status", self.status_text)
+        digest = part.get("digest")
+        if digest and part.get("total"):
+            self.layers[digest] = {"total": part["total"], "completed": part.get("completed", 0)}
+            now = time.monotonic()
+            self._samples.append((now, self.completed))
+            while self._samples and now - self._samples[0][0] > THROUGHPUT_WINDOW:
+                self._samples.popleft()
+
+
+class DownloadManager:
+    """
+    Pulls models in the background with the streaming pull API. Several pulls can be queued, at most
+    max_concurrent run at the same time. Pulls run on the shared client loop, so the UI and chats with
+    installed models keep working. Interrupted pulls are retried; Ollama keeps the layers it already has,
+    so a retry or resume() continues where the download stopped. Listeners are called with the Download
+    whenever its progress changes.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_DOWNLOADS, max_retries=MAX_RETRIES):
+        self.max_concurrent = max_concurrent
+        self.max_retries = max_retries
+        self.downloads = {}
+        self._listeners = []
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, download):
+        for listener in list(self._listeners):
+            listener(download)
+
+    def start(self, name):
+        # Starting a model that is already being downloaded returns the running download
+        with self._lock:
+            download = self.downloads.get(name)
+            if download and download.active:
+                return download
+            download = Download(name)
+            self.downloads[name] = download
+            download.future = get_client().submit(self._run(download))
+        self._notify(download)
+        return download
+
+    def resume(self, name):
+        return self.start(name)
+
+    def cancel(self, name):
+        download = self.downloads.get(name)
+        if download and download.active:
+            # Cancelling the task closes the stream, Ollama keeps the partial layers for a resume
+            download.future.cancel()
+
+    def remove(self, name):
+        download = self.downloads.get(name)
+        if download and not download.active:
+            del self.downloads[name]
+
+    async def _run(self, download):
+        # Runs on the client loop, the semaphore is created there
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        try:
+            async with self._semaphore:
+                download.status = "downloading"
+                download.status_text = "Starting..."
+                self._notify(download)
+                await self._pull(download)
+            download.status = "done"
+            download.status_text = "Downloaded"
+            model_registry.invalidate()
+            await model_registry.refresh(force=True)
+        except asyncio.CancelledError:
+            download.status = "cancelled"
+            download.status_text = "Cancelled"
+        except Exception as e:
+            download.status = "failed"
+            download.error = e
+            download.status_text = f"Failed: {e}"
+        self._notify(download)
+
+    async def _pull(self, download):
+        attempt = 0
+        while True:
+            try:
+                last_notify = 0.0
+                async for part in await get_client().aio.pull(download.name, stream=True):
+                    download.update(part)
+                    now = time.monotonic()
+                    if now - last_notify >= NOTIFY_INTERVAL:
+                        self._notify(download)
+                        last_notify = now
+                return
+            except (httpx.TransportError, ollama.ResponseError) as e:
+                # A missing model can't be fixed by retrying
+                if (isinstance(e, ollama.ResponseError) and e.status_code == 404) or "file does not exist" in str(e):
+                    raise
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                download.status_text = f"Connection lost, resuming ({attempt}/{self.max_retries})..."
+                self._notify(download)
+                await asyncio.sleep(RETRY_DELAY * attempt)
+
+
+download_manager = DownloadManager()
@@ -0,0 +1,34 @@
+class ChatEvents:
+    """
+    Callbacks of OllamaCall, so the conversation engine runs without knowing about a front end. All methods
+    do nothing here; a front end subclasses ChatEvents, overrides what it shows and is added with
+    OllamaCall.subscribe(). Events are delivered on the thread that caused them: the event loop of the
+    answer, an ingestion thread or the chat title thread.
+    """
+
+    def chat_added(self, chat_name):
+        # The chat was saved, either for the first time or moved to the top of the recent chats
+        pass
+
+    def chat_renamed(self, old_name, new_name):
+        # The provisional name of a new chat was replaced by the generated title
+        pass
+
+    def chat_reset(self):
+        # History and attachments were cleared, before a new chat starts or another one is loaded
+        pass
+
+    def history_changed(self):
+        # The history was replaced outside of an answer, e.g. by new_chat()
+        pass
+
+    def file_added(self, file_path):
+        # Ingestion of an attachment started
+        pass
+
+    def file_progress(self, file_path, done_pages, total_pages):
+        pass
+
+    def file_processed(self, file_path, error):
+        # error is None if the attachment is ready to be sent
+        pass
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+
+METRICS_DIR = "metrics"
+# Number of responses kept in the rolling log
+MAX_ENTRIES = 5000
+# Values aggregated per model in the summary
+AGGREGATED = ("ttft_ms", "tokens_per_s", "prompt_tokens", "prompt_eval_ms", "load_ms", "total_ms")
+
+
+def ns_to_ms(value):
+    return round(value / 1e6, 1) if value else 0.0
+
+
+def response_metrics(model, final_part, started, first_token_at, finished, queue_ms=0.0, cached=False):
+    """
+    Metrics of one response. started, first_token_at and finished are time.perf_counter() values,
+    final_part is the last chunk of the stream (with Ollama's counters and durations in ns), None if the
+    answer was stopped before it was complete. A cached answer only has the replay times.
+    """
+    metrics = {
+        'model': model,
+        'created': time.time(),
+        'queue_ms': round(queue_ms, 1),
+        'ttft_ms': round((first_token_at - started) * 1000, 1) if first_token_at else None,
+        'total_ms': round((finished - started) * 1000, 1),
+        'stopped': final_part is None,
+    }
+    if cached:
+        metrics['cached'] = True
+    elif final_part is not None:
+        eval_count = final_part.get('eval_count', 0)
+        eval_duration = final_part.get('eval_duration', 0)
+        metrics.update({
+            'eval_tokens': eval_count,
+            'tokens_per_s': round(eval_count / (eval_duration / 1e9), 1) if eval_duration else None,
+            'prompt_tokens': final_part.get('prompt_eval_count', 0),
+            'prompt_eval_ms': ns_to_ms(final_part.get('prompt_eval_duration')),
+            'load_ms': ns_to_ms(final_part.get('load_duration')),
+        })
+    return metrics
+
+
+def format_metrics(metrics):
+    """
+    One-line footer shown under an answer, e.g. "TTFT 0.42 s · 38.1 tok/s · 512 prompt tokens in 0.31 s".
+    """
+    parts = ["cached answer"] if metrics.get('cached') else []
+    if metrics.get('ttft_ms') is not None:
+        parts.append(f"TTFT {metrics['ttft_ms'] / 1000:.2f} s")
+    if metrics.get('tokens_per_s'):
+        parts.append(f"{metrics['tokens_per_s']:.1f} tok/s")
+    if metrics.get('prompt_tokens'):
+        parts.append(f"{metrics['prompt_tokens']} prompt tokens in {metrics['prompt_eval_ms'] / 1000:.2f} s")
+    if metrics.get('load_ms', 0) >= 10:
+        parts.append(f"load {metrics['load_ms'] / 1000:.2f} s")
+    if metrics.get('queue_ms', 0) >= 10:
+        parts.append(f"queued {metrics['queue_ms'] / 1000:.2f} s")
+    return " · ".join(parts)
+
+
+def percentile(values, q, digits=1):
+    # Linear interpolation between the closest ranks, values must be sorted
+    if not values:
+        return None
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return round(values[lower] + (values[upper] - values[lower]) * (position - lower), digits)
+
+
+class MetricsLog:
+    """
+    Rolling log of the response metrics (metrics.jsonl, the last max_entries responses) and a summary with
+    per-model count, p50 and p95 of the AGGREGATED values (summary.json), rewritten after every response.
+    """
+
+    def __init__(self, folder=METRICS_DIR, max_entries=MAX_ENTRIES):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.log_path = os.path.join(folder, "metrics.jsonl")
+        self.summary_path = os.path.join(folder, "summary.json")
+        self._entries = None
+        self._lines = 0
+        self._lock = threading.Lock()
+
+    def entries(self):
+        with self._lock:
+            return list(self._load())
+
+    def _load(self):
+        if self._entries is None:
+            self._entries = deque(maxlen=self.max_entries)
+            self._lines = 0
+            if os.path.exists(self.log_path):
+                with open(self.log_path, "r", encoding="utf-8") as file:
+                    for line in file:
+                        self._lines += 1
+                        try:
+                            self._entries.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            # A line cut off by a crash
+                            continue
+        return self._entries
+
+    def record(self, metrics):
+        with self._lock:
+            entries = self._load()
+            entries.append(metrics)
+            os.makedirs(self.folder, exist_ok=True)
+            # The file grows to twice the window before it's cut back to the window, so most writes are appends
+            if self._lines >= 2 * self.max_entries:
+                self._rewrite(entries)
+            else:
+                with open(self.log_path, "a", encoding="utf-8") as file:
+                    file.write(json.dumps(metrics) + "\n")
+                self._lines += 1
+            self._write_summary(entries)
+
+    def _rewrite(self, entries):
+        tmp_path = self.log_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.writelines(json.dumps(entry) + "\n" for entry in entries)
+        os.replace(tmp_path, self.log_path)
+        self._lines = len(entries)
+
+    def summary(self, entries=None):
+        """
+        {model: {'count': n, '<value>': {'p50': .., 'p95': ..}, ...}} over the rolling window.
+        """
+        entries = self.entries() if entries is None else entries
+        by_model = {}
+        for entry in entries:
+            by_model.setdefault(entry['model'], []).append(entry)
+        summary = {}
+        for model, model_entries in sorted(by_model.items()):
+            stats = {'count': len(model_entries)}
+            for key in AGGREGATED:
+                values = sorted(entry[key] for entry in model_entries if entry.get(key) is not None)
+                if values:
+                    stats[key] = {'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95)}
+            summary[model] = stats
+        return summary
+
+    def _write_summary(self, entries):
+        tmp_path = self.summary_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(self.summary(entries), file, indent=2)
+        os.replace(tmp_path, self.summary_path)
+
+
+metrics_log = MetricsLog()
@@ -0,0 +1,155 @@
+import time
+import asyncio
+import threading
+
+from bot.client import get_client
+
+DEFAULT_TTL = 30.0
+# A failed show request (model missing, Ollama down) is repeated at most this often
+FAILED_DETAILS_TTL = 10.0
+
+
+def model_entry(model):
+    # Flattens an entry of the list endpoint into the fields the UI needs
+    details = model.get('details') or {}
+    return {
+        'name': model['name'],
+        'digest': model.get('digest', ''),
+        'size': model.get('size', 0),
+        'family': details.get('family', ''),
+        'parameter_size': details.get('parameter_size', ''),
+        'quantization': details.get('quantization_level', ''),
+    }
+
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} B"
+        size /= 1024
+
+
+class ModelRegistry:
+    """
+    Cached list of the installed models. The list endpoint is only called when the cache is older than
+    `ttl` seconds (or on refresh(force=True)), concurrent refreshes share one request. Listeners are
+    called with the new list whenever it changes. Details from the show endpoint (e.g. the context length)
+    are fetched once per model digest, a failure is remembered for FAILED_DETAILS_TTL seconds.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self.models = []
+        self._fetched_at = 0.0
+        self._inflight = None
+        self._details = {}
+        # (name, digest) -> (time, exception) of the last failed show request
+        self._details_failures = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def names(self):
+        return [model['name'] for model in self.models]
+
+    def get(self, name):
+        return next((model for model in self.models if model['name'] == name), None)
+
+    def is_fresh(self):
+        return bool(self._fetched_at) and time.monotonic() - self._fetched_at < self.ttl
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def invalidate(self):
+        # Called after a model was pulled or deleted
+        self._fetched_at = 0.0
+
+    def _start_refresh(self):
+        # Returns a concurrent.futures.Future, a refresh that is already running is shared
+        with self._lock:
+            if self._inflight is None:
+                self._inflight = get_client().submit(self._fetch())
+                self._inflight.add_done_callback(self._clear_inflight)
+            return self._inflight
+
+    def _clear_inflight(self, future):
+        with self._lock:
+            if self._inflight is future:
+                self._inflight = None
+
+    async def _fetch(self):
+        # Runs on the client loop, the future only resolves once the cache is updated
+        response = await get_client().aio.list()
+        models = [model_entry(model) for model in response['models']]
+        self._fetched_at = time.monotonic()
+        if models != self.models:
+            self.models = models
+            for listener in list(self._listeners):
+                listener(models)
+        return models
+
+    async def refresh(self, force=False):
+        if force or not self.is_fresh():
+            await asyncio.wrap_future(self._start_refresh())
+        return self.models
+
+    def refresh_sync(self, force=False):
+        if force or not self.is_fresh():
+            self._start_refresh().result()
+        return self.models
+
+    def refresh_in_background(self, force=False):
+        # Listeners are notified when the list arrives
+        if force or not self.is_fresh():
+            self._start_refresh()
+
+    def details(self, name):
+        """
+        Metadata of a model: family, parameter size, quantization, context length and tokenizer type.
+        Fetched once per digest.
+        """
+        model = self.get(name) or {'name': name, 'digest': ''}
+        key = (name, model['digest'])
+        if key not in self._details:
+            failure = self._details_failures.get(key)
+            if failure and time.monotonic() - failure[0] < FAILED_DETAILS_TTL:
+                # e.g. the model is still being downloaded, Ollama isn't asked again on every call
+                raise failure[1]
+            try:
+                info = get_client().sync.show(name)
+            except Exception as e:
+                self._details_failures[key] = (time.monotonic(), e)
+                raise
+            self._details_failures.pop(key, None)
+            model_info = info.get('model_info') or {}
+            details = info.get('details') or {}
+            context_length = next((value for key_name, value in model_info.items()
+                                   if key_name.endswith('.context_length')), None)
+            self._details[key] = {
+                'family': details.get('family', model.get('family', '')),
+                'parameter_size': details.get('parameter_size', model.get('parameter_size', '')),
+                'quantization': details.get('quantization_level', model.get('quantization', '')),
+                'context_length': context_length,
+                # e.g. "gpt2" (BPE, Llama 3, Qwen) or "llama" (SentencePiece, Llama 2, Mistral)
+                'tokenizer': model_info.get('tokenizer.ggml.model'),
+            }
+        return self._details[key]
+
+    async def details_async(self, name):
+        return await asyncio.to_thread(self.details, name)
+
+    def cached_details(self, name):
+        # Details if they were fetched already, None otherwise, never blocks
+        model = self.get(name) or {'name': name, 'digest': ''}
+        return self._details.get((name, model['digest']))
+
+    def prefetch_details(self, name):
+        # Fetches the details in the background, returns a concurrent.futures.Future
+        return get_client().submit(self.details_async(name))
+
+
+model_registry = ModelRegistry()
@@ -1,115 +1,377 @@
-import subprocess
 import time
-import os
 import ollama
-from ollama import AsyncClient
 import asyncio
-from pathlib import Path
-
+import threading
+import httpx
+from contextlib import nullcontext
+
+from bot.client import get_client
+from bot.metrics import response_metrics, metrics_log
+from bot.compaction import Compactor
+from bot.response_cache import response_cache, replay, DETERMINISTIC_OPTIONS
+from bot.prompt_builder import PromptBuilder
+from bot.residency import model_residency
+from bot.tokens import PromptCounter, request_options, context_window
+from bot.retrieval import Retriever
+from bot.scheduler import get_scheduler
 from utils import utils
+from utils.ingestion import ingestion_pipeline, is_supported, file_type
 
 
 class OllamaCall:
-    def __init__(self, model="llama3.2:latest" ):
+    """
+    Conversation engine: history, attachments, prompt building, answers and saving. It doesn't depend on a
+    front end, what happens is reported to the ChatEvents listeners added with subscribe().
+    With persist=False nothing is written to the chat folder, e.g. for batch runs.
+    """
+
+    def __init__(self, model="llama3.2:latest", use_retrieval=False, title_model=None, chat_folder="saved_chats",
+                 user_id="local", use_compaction=False, options=None, persist=True):
         self.model = model
         self.current_chat = []
         self.name_current_chat = ""
         self.unsaved_text = []
-        self.UI = None
+        self.persist = persist
+        self.listeners = []
         self.files = []
         self.processed_files = []
+        self.file_hashes = {}
+        self.pending_files = {}
+        self.prompt_builder = PromptBuilder()
+        # With retrieval, only the chunks relevant to a prompt are sent instead of the full documents
+        self.use_retrieval = use_retrieval
+        self.retriever = Retriever()
+        # Model for chat titles, None reuses the chat model
+        self.title_model = title_model
+        # Guards the chat name while a title is generated in the background
+        self.chat_lock = threading.RLock()
+        # Every user has their own chat folder, requests are scheduled fairly between users
+        self.chat_folder = chat_folder
+        self.user_id = user_id
+        # With compaction, older turns are replaced by a rolling summary once the history gets too long
+        self.use_compaction = use_compaction
+        self.compactor = self.new_compactor()
+        # Generation options sent with every request (temperature, seed, ...)
+        self.options = dict(options or {})
+        # Opt-in: answers are cached on disk and replayed when the same messages are sent again
+        self.use_response_cache = False
+        # Metrics of the last response (TTFT, tokens/s, prompt tokens, load time)
+        self.last_metrics = None
+        # num_ctx of the last request, follow-up requests with the same model reuse it so it isn't reloaded
+        self.last_num_ctx = None
+        # Size of the next request for the prompt indicator, counted incrementally
+        self.prompt_counter = PromptCounter()
+
+
+
+    async def send_message(self, prompt, on_queue_position=None, on_recorded=None):
+        """
+        Streams the answer to prompt. on_queue_position(position) is called while the request waits for a
+        free slot of the scheduler (0 once it runs). Raises QueueFull if too many requests are waiting.
+        on_recorded() is called once the prompt is part of the history; stopped before that, nothing is kept.
+        """
+        self.last_metrics = None
+        # Attachments that are still being processed have to be part of this message
+        await self.wait_for_files()
 
-
-
-    async def send_message(self, prompt):
-        # Append the user's message to the conversation history
         user_message = {'role': 'user', 'content': prompt}
-        message = self.create_message(prompt)
-        self.current_chat.append(user_message)
-        self.unsaved_text.append(user_message)
-        assistant_message = ""
-
-        # Stream the response
-        async for part in await AsyncClient().chat(model=self.model, messages=message, stream=True):
-            # Check if part contains the expected keys; if not, break out of the loop
-            if 'message' not in part or 'content' not in part['message']:
-                break
-            assistant_message+=part['message']['content']
-            yield part['message']['content']
-
-
-        self.current_chat.append({'role' : 'assistant', 'content' : assistant_message})
-        self.unsaved_text.append({'role' : 'assistant', 'content' : assistant_message})
+        # Building the message can embed the prompt (retrieval), so it runs off the event loop
+        message = await asyncio.to_thread(self.create_message, prompt)
+        # Reads the model's context length, a request on the first message with a model
+        options = await asyncio.to_thread(self.request_options, message)
+        self.last_num_ctx = options['num_ctx']
+
+        # With deterministic sampling, an answer to the exact same messages can come from the response cache
+        cache_key, cached = None, None
+        if self.use_response_cache:
+            cache_key = response_cache.key(self.model, options, message)
+            cached = await asyncio.to_thread(response_cache.get_response, cache_key) if cache_key else None
+
+        queued_at = time.perf_counter()
+        # A cached answer doesn't use Ollama, so it doesn't wait for a slot
+        async with nullcontext() if cached else get_scheduler().slot(self.user_id, on_queue_position):
+            # Append the user's message to the conversation history
+            self.current_chat.append(user_message)
+            self.unsaved_text.append(user_message)
+            if on_recorded:
+                on_recorded()
+            assistant_parts = []
+            stopped = True
+            failed = False
+            started = time.perf_counter()
+            first_token_at = None
+            final_part = None
+
+            # Stream the response. If the task is cancelled (Stop), the stream is closed, which closes the
+            # HTTP response so Ollama stops generating, and the partial answer is kept.
+            # A cached answer is replayed as the same kind of chunks.
+            model = self.model
+            if not cached:
+                model_residency.begin(model)
+            try:
+                if cached:
+                    stream = replay(cached)
+                else:
+                    stream = await get_client().aio.chat(model=model, messages=message, stream=True,
+                                                         options=options, keep_alive=model_residency.keep_alive(model))
+                async for part in stream:
+                    # Check if part contains the expected keys; if not, break out of the loop
+                    if 'message' not in part or 'content' not in part['message']:
+                        break
+                    if part.get('done'):
+                        # The last chunk carries Ollama's token counts and durations
+                        final_part = part
+                    if first_token_at is None and part['message']['content']:
+                        first_token_at = time.perf_counter()
+                    assistant_parts.append(part['message']['content'])
+                    yield part['message']['content']
+                stopped = False
+            except Exception:
+                # e.g. Ollama isn't reachable. Only a stopped answer is kept, after an error the prompt is taken
+                # back and nothing is saved, the caller shows the error
+                failed = True
+                raise
+            finally:
+                if not cached:
+                    model_residency.end(model, loaded=final_part is not None or first_token_at is not None,
+                                        options=options)
+                if failed:
+                    self.current_chat.pop()
+                    self.unsaved_text.pop()
+                else:
+                    self.last_metrics = response_metrics(self.model, final_part, started, first_token_at,
+                                                         time.perf_counter(), (started - queued_at) * 1000,
+                                                         cached=cached is not None)
+                    assistant_message = {'role' : 'assistant', 'content' : "".join(assistant_parts),
+                                         'meta': {'metrics': self.last_metrics}}
+                    if stopped:
+                        assistant_message['meta']['stopped'] = True
+                    self.current_chat.append(assistant_message)
+                    self.unsaved_text.append(assistant_message)
+                    self.save_chat_entry()
+                    if self.use_compaction:
+                        # Summarizes older turns in the background if the history got too long for the next request
+                        self.compactor.compact_in_background(self.current_chat, self.model, self.options.get('num_ctx'))
+                    if cache_key and not cached and not stopped:
+                        threading.Thread(target=response_cache.put_response, args=(cache_key, assistant_message['content']),
+                                         daemon=True).start()
+                    if not cached:
+                        # The rolling log and its summary are written off the event loop, replayed answers would
+                        # only skew the model's numbers
+                        threading.Thread(target=metrics_log.record, args=(self.last_metrics,), daemon=True).start()
+
+
+    def request_options(self, messages, model=None):
+        # The chat's options, with a num_ctx fitted to messages unless it's set there
+        return request_options(model or self.model, messages, self.options)
+
+    def adopt_answer(self, prompt, content, metrics=None):
+        """
+        Adds prompt and an answer generated outside of send_message (e.g. in compare mode) to the chat,
+        as if it had been sent to the chat's model.
+        """
+        meta = {'metrics': metrics} if metrics else {}
+        messages = [{'role': 'user', 'content': prompt}, {'role': 'assistant', 'content': content, 'meta': meta}]
+        self.current_chat.extend(messages)
+        self.unsaved_text.extend(messages)
         self.save_chat_entry()
-
+        if self.use_compaction:
+            self.compactor.compact_in_background(self.current_chat, self.model, self.options.get('num_ctx'))
+
+    def preload_options(self, prompt=""):
+        # Options the next request will likely be sent with, a model preloaded with others is reloaded by it
+        return {**self.options, 'num_ctx': self.prompt_size(prompt)['num_ctx']}
+
+    def prompt_size(self, prompt=""):
+        # Estimated size of the next request if prompt is sent, without building it
+        if self.use_compaction:
+            summary, start = self.compactor.summary, self.compactor.summarized
+        else:
+            summary, start = None, 0
+        return self.prompt_counter.estimate(self.model, self.current_chat, prompt, self.processed_files, summary,
+                                            start, self.use_retrieval, self.options.get('num_ctx'))
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def emit(self, event, *args):
+        # Calls the ChatEvents method `event` of every listener
+        for listener in list(self.listeners):
+            getattr(listener, event)(*args)
+
+    def set_response_cache(self, enabled):
+        # Cached answers are only valid with deterministic sampling, so switching the cache on fixes it
+        self.use_response_cache = enabled
+        if enabled:
+            self.options.update(DETERMINISTIC_OPTIONS)
+        else:
+            for option in DETERMINISTIC_OPTIONS:
+                self.options.pop(option, None)
 
     def upload_file(self, file_path):
-        if Path(file_path).suffix.lower() == '.pdf':
-            self.files.append(file_path)
-            pdf_content = utils.read_PDF(file_path)
-            self.processed_files.append({"file": file_path,"type": '.pdf', "content": pdf_content})
+        if is_supported(file_path):
+            # Extracted text comes from the content-addressed cache when the document was seen before
+            file_hash, document = utils.read_document_cached(file_path, self.file_hashes.get(file_path))
+            self.add_processed_file(file_path, file_hash, document)
+
+    def upload_files(self, file_paths):
+        """
+        Starts ingesting the files in the background and returns immediately. Progress is reported with the
+        file_added, file_progress and file_processed events, from the ingestion threads.
+        """
+        for file_path in file_paths:
+            self.emit("file_added", file_path)
+            future = ingestion_pipeline.submit(file_path, self.file_hashes.get(file_path),
+                                               lambda *progress: self.emit("file_progress", *progress))
+            self.pending_files[file_path] = future
+            future.add_done_callback(lambda f, path=file_path: self._file_ingested(path, f))
+
+    def _file_ingested(self, file_path, future):
+        # The file was removed or the chat was reset while it was being processed
+        if self.pending_files.get(file_path) is not future:
+            return
+        error = future.exception()
+        if error is None:
+            file_hash, document = future.result()
+            self.add_processed_file(file_path, file_hash, document)
+        del self.pending_files[file_path]
+        self.emit("file_processed", file_path, error)
+
+    def add_processed_file(self, file_path, file_hash, document):
+        # Only the memory-mapped Document is kept, its text is read when a prompt needs it
+        self.files.append(file_path)
+        self.file_hashes[file_path] = file_hash
+        self.processed_files.append({"file": file_path, "type": file_type(file_path), "document": document})
+        if self.use_retrieval:
+            try:
+                self.retriever.add_document(file_hash, file_path, document)
+            except Exception:
+                # e.g. embedding model not installed, indexing is retried when the message is sent
+                pass
+
+    def remove_file(self, file_path):
+        self.pending_files.pop(file_path, None)
+        if file_path in self.files:
+            if file_path in self.file_hashes:
+                self.retriever.remove_document(self.file_hashes[file_path])
+            self.processed_files = [entry for entry in self.processed_files if entry["file"] != file_path]
+            self.files.remove(file_path)
+            self.file_hashes.pop(file_path, None)
+            if self.name_current_chat:
+                utils.store_submitted_files(self.files, self.name_current_chat, self.file_hashes, self.chat_folder)
+
+    async def wait_for_files(self):
+        # Only blocks when a message is sent before all attachments are processed
+        pending = list(self.pending_files.values())
+        if pending:
+            await asyncio.gather(*(asyncio.wrap_future(future) for future in pending), return_exceptions=True)
 
 
     def create_message(self, prompt):
-        context = ""
-        file_content = ""
-        if self.files:
-            for file in self.processed_files:
-                if file['type']=='.pdf':
-
-                    file_content += (
-                    "This PDF document has been uploaded and processed to extract its content. "
-                    "The following text may contain formatting irregularities, especially in tables, formulas, or structured layouts. "
-                    "Please focus on summarizing the main points, important findings, key concepts, and relevant details of the document. "
-                    "Ignore less relevant parts like References, bibliographies, or sections focused solely on citations unless specifically asked. "
-                    "If the document appears to be technical, highlight the core methodology, findings, and conclusions. "
-                    "For non-technical documents, emphasize the primary topics, arguments, and takeaways. "
-                    "Here is the content of the file:\n\n" + file['content']
-                    )
-
-
-
-        if self.current_chat:
-            # Instruction to treat the following conversation as context only
-            context += (
-                "The following part between brackets is only for context. "
-                "Do not react to it or include it in your response. "
-                "It is here solely as memory to help with continuity.\n("
-            )
-
-            for old_conv in self.current_chat:
-                context+=old_conv['role'] + ": " + old_conv['content'] + "\n"
-
-            context += ") End of context.\n Now, answer the following question:\n"
-        message = context + prompt + file_content
-        return [{'role': 'user', 'content': message}]
-
-
-    def generate_chat_name(self):
+        # System message with the (cached) file context, then the real conversation turns
+        excerpts = None
+        if self.use_retrieval and self.processed_files:
+            try:
+                self.index_files()
+                doc_ids = {self.file_hashes[file_path] for file_path in self.files}
+                excerpts = self.retriever.relevant_chunks(prompt, doc_ids)
+            except (ollama.ResponseError, httpx.HTTPError):
+                # Fall back to sending the full documents if the embedding model isn't available
+                excerpts = None
+        summary, history = self.compacted_history()
+        return self.prompt_builder.build(history, prompt, self.processed_files, excerpts, summary)
+
+    def compacted_history(self):
+        # Without compaction the whole history is sent
+        if not self.use_compaction:
+            return None, self.current_chat
+        compactor = self.compactor
+        compactor.compact_in_background(self.current_chat, self.model, self.options.get('num_ctx'))
+        # Past the whole context window Ollama would cut the prompt, so the running compaction is waited for
+        if compactor.history_tokens(self.current_chat, self.model) > context_window(self.model, self.options.get('num_ctx')):
+            compactor.wait()
+        return compactor.view(self.current_chat)
+
+    def new_compactor(self, summary="", summarized=0):
+        return Compactor(summary, summarized, on_update=self._summary_updated)
+
+    def _summary_updated(self, compactor):
+        # The chat was reset or another chat was opened while the summary was written
+        with self.chat_lock:
+            if compactor is not self.compactor or not self.name_current_chat:
+                return
+            utils.save_chat_summary(self.name_current_chat, compactor.summary, compactor.summarized, self.chat_folder)
+
+    def index_files(self):
+        # Embeds the attached files that aren't in the chat's index yet
+        for file in self.processed_files:
+            self.retriever.add_document(self.file_hashes[file['file']], file['file'], file['document'])
+
+
+    def generate_chat_name(self, messages):
         content = ("The following is the first two messages of a conversation. Please think of an appropriate, short title"
                    "that describes this conversatioin. It should be as short as possible. Only output the title you came up with "
                    "and nothing else! It can not include any special symbols like question marks, dots or anything that can't be in"
                    "a file name of a windows machine. Here is the conversation: \n")
-        for old_conv in self.current_chat:
+        for old_conv in messages:
             content += old_conv['role'] + ": " + old_conv['content'] + "\n"
-        self.name_current_chat = ollama.chat(model='llama3.2:latest', messages=[{
+        # Without a dedicated title model, the model that is already loaded is used, so no other model is swapped in
+        model = self.title_model or self.model
+        request = [{
             'role' : 'user',
             'content' : content
-        }])['message']['content']
+        }]
+        options = self.request_options(request, model)
+        if model == self.model and self.last_num_ctx:
+            # The window of the answer that was just generated, a smaller one would reload the model
+            options['num_ctx'] = max(options['num_ctx'], self.last_num_ctx)
+        with model_residency.in_use(model, options):
+            return get_client().sync.chat(model=model, messages=request, options=options,
+                                          keep_alive=model_residency.keep_alive(model))['message']['content']
+
+    def generate_chat_name_in_background(self, provisional_name, messages):
+        def run():
+            try:
+                title = utils.sanitize_chat_name(self.generate_chat_name(messages))
+            except Exception:
+                # Keep the provisional name if the title can't be generated
+                return
+            if not title or title == provisional_name:
+                return
+            with self.chat_lock:
+                new_name = utils.rename_chat(provisional_name, title, self.chat_folder)
+                if self.name_current_chat == provisional_name:
+                    self.name_current_chat = new_name
+            self.emit("chat_renamed", provisional_name, new_name)
+
+        threading.Thread(target=run, name="chat-title", daemon=True).start()
 
     def save_chat_entry(self):
+        if not self.persist:
+            self.unsaved_text = []
+            return
         new_name = False
-        if not self.name_current_chat:
-            self.generate_chat_name()
-            new_name = True
-
-        # Define the file path
-        utils.save_chat_entry(self.name_current_chat, self.unsaved_text)
-        self.unsaved_text = []
-        if self.files:
-            utils.store_submitted_files(self.files, self.name_current_chat)
+        with self.chat_lock:
+            if not self.name_current_chat:
+                # Save right away under a title taken from the first prompt, the LLM title follows later
+                self.name_current_chat = utils.unique_chat_name(utils.provisional_chat_name(self.current_chat), self.chat_folder)
+                new_name = True
+
+            # Define the file path
+            utils.save_chat_entry(self.name_current_chat, self.unsaved_text, self.chat_folder)
+            self.unsaved_text = []
+            if self.files:
+                utils.store_submitted_files(self.files, self.name_current_chat, self.file_hashes, self.chat_folder)
+            if len(self.retriever.index):
+                self.retriever.save(utils.chat_index_path(self.name_current_chat, self.chat_folder))
         if new_name:
-            self.UI.load_chat_files()
+            self.generate_chat_name_in_background(self.name_current_chat, list(self.current_chat[:2]))
+        # e.g. moves the chat to the top of the sidebar, or adds it if it's new
+        self.emit("chat_added", self.name_current_chat)
 
 
     def reset_chat(self):
@@ -119,29 +381,36 @@ class OllamaCall:
         # Clears the conversation history
         self.current_chat = []
         self.files = []
+        self.processed_files = []
+        self.file_hashes = {}
+        self.pending_files = {}
+        self.prompt_builder.invalidate()
+        self.retriever.reset()
+        self.compactor = self.new_compactor()
         self.name_current_chat = ""
-        self.UI.file_chips.controls.clear()
-        self.UI.page.update()
+        self.emit("chat_reset")
 
     def new_chat(self):
         self.reset_chat()
-        self.UI.chat_content = ""
-        self.UI.update_prompt()
+        self.emit("history_changed")
 
-    def load_chat(self, file_name):
+    def load_chat(self, chat_name):
         # Reset chat data
         self.reset_chat()
 
-        # File path for the chat file
-        file_path = os.path.join("saved_chats", file_name)
-
-        # Load chat lines and populate current_chat
-        for message in utils.load_chat_file(file_path):
-            self.current_chat.append(message)
-        self.files = utils.load_submitted_files(os.path.join("saved_chats", file_name.replace(".txt", ".pkl")))
-        self.UI.process_files(self.files)
+        # Load the messages and populate current_chat
+        self.current_chat.extend(utils.load_chat_file(chat_name, self.chat_folder))
+        # The vector index is stored next to the chat, so documents don't have to be embedded again
+        self.retriever.load(utils.chat_index_path(chat_name, self.chat_folder))
+        summary = utils.load_chat_summary(chat_name, self.chat_folder)
+        if summary:
+            self.compactor = self.new_compactor(summary["content"], summary["message_count"])
+        attachments = utils.load_submitted_files(chat_name, self.chat_folder)
+        self.file_hashes = {entry["path"]: entry["hash"] for entry in attachments if entry["hash"]}
+        # Ingestion adds the paths to self.files again
+        self.upload_files([entry["path"] for entry in attachments])
         # Set the current chat name
-        self.name_current_chat = file_name.replace(".txt", "")
+        self.name_current_chat = chat_name
 
 
 
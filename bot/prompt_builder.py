@@ -0,0 +1,88 @@
+PDF_INSTRUCTIONS = (
+    "This PDF document has been uploaded and processed to extract its content. "
+    "The following text may contain formatting irregularities, especially in tables, formulas, or structured layouts. "
+    "Please focus on summarizing the main points, important findings, key concepts, and relevant details of the document. "
+    "Ignore less relevant parts like References, bibliographies, or sections focused solely on citations unless specifically asked. "
+    "If the document appears to be technical, highlight the core methodology, findings, and conclusions. "
+    "For non-technical documents, emphasize the primary topics, arguments, and takeaways. "
+)
+
+SYSTEM_PROMPT = "You are a helpful assistant. The user may attach documents, their content is given below."
+
+RETRIEVAL_PROMPT = (
+    "You are a helpful assistant. The user has attached the documents listed below. "
+    "With each question you get the excerpts of these documents that are most relevant to it. "
+    "The excerpts may contain formatting irregularities, especially in tables, formulas, or structured layouts."
+)
+
+SUMMARY_HEADER = "Summary of the earlier part of this conversation:\n"
+
+
+class PromptBuilder:
+    """
+    Builds the message list sent to Ollama. The list is append-only between turns: a system message
+    holding the file context, followed by the real user/assistant turns. As long as the attached files
+    don't change, turn N+1 starts with exactly the same bytes as turn N, so Ollama can reuse its KV cache
+    and only evaluates the new tokens.
+    """
+
+    def __init__(self, system_prompt=SYSTEM_PROMPT):
+        self.system_prompt = system_prompt
+        self._files_key = None
+        self._system_message = None
+
+    def file_context(self, processed_files, retrieval=False):
+        # The system message only changes when the set of attached files (or the mode) changes
+        key = (retrieval, tuple(file['file'] for file in processed_files))
+        if key != self._files_key or self._system_message is None:
+            render = self._render_file_list if retrieval else self._render_files
+            self._system_message = {'role': 'system', 'content': render(processed_files)}
+            self._files_key = key
+        return self._system_message
+
+    def _render_file_list(self, processed_files):
+        if not processed_files:
+            return ""
+        return RETRIEVAL_PROMPT + "\n\nAttached documents:\n" + "\n".join(f"- {file['file']}" for file in processed_files)
+
+    def _render_files(self, processed_files):
+        # The documents' text is only read from the extraction cache here, once per set of files
+        parts = [self.system_prompt] if processed_files else []
+        for file in processed_files:
+            text = file['document'].text()
+            if file['type'] == '.pdf':
+                parts.append(
+                    PDF_INSTRUCTIONS
+                    + f"Here is the content of the file {file['file']}:\n\n" + text
+                )
+            else:
+                parts.append(f"Here is the content of the file {file['file']}:\n\n```\n{text}\n```")
+        return "\n\n".join(parts)
+
+    def invalidate(self):
+        self._files_key = None
+        self._system_message = None
+
+    def build(self, history, prompt, processed_files=(), excerpts=None, summary=None):
+        """
+        excerpts: chunks picked by the retriever for this prompt. If given, the system message only lists
+        the attached files and the excerpts go into the last message, after the stable prefix.
+        summary: rolling summary of the turns before history (compaction). It follows the file context and
+        only changes when the chat is compacted again, so the prefix stays stable in between.
+        """
+        messages = []
+        system_message = self.file_context(processed_files, retrieval=excerpts is not None)
+        if system_message['content']:
+            messages.append(system_message)
+        if summary:
+            messages.append({'role': 'system', 'content': SUMMARY_HEADER + summary})
+        # Copy only role and content, so extra keys stored in the history never change the prefix
+        messages.extend({'role': m['role'], 'content': m['content']} for m in history)
+        if excerpts:
+            prompt = (
+                "Relevant excerpts from the attached documents:\n\n"
+                + "\n\n".join(f"[{chunk['file']}]\n{chunk['text']}" for chunk in excerpts)
+                + "\n\nQuestion: " + prompt
+            )
+        messages.append({'role': 'user', 'content': prompt})
+        return messages
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+import threading
+from contextlib import contextmanager
+
+import httpx
+import ollama
+
+from bot.client import get_client
+
+# Models that weren't used for this many seconds are unloaded, 0 leaves it to the server's keep-alive
+IDLE_UNLOAD_SECONDS = float(os.getenv("OLLAMA_UI_IDLE_UNLOAD", "900"))
+# The keep_alive sent with requests is the idle limit plus this margin, so Ollama still frees the model
+# if the app is closed, but never before the app unloads it
+KEEP_ALIVE_MARGIN = 60.0
+CHECK_INTERVAL = 30.0
+# Options that decide how Ollama loads a model, a request with other values than the loaded ones reloads it
+LOAD_OPTIONS = ('num_ctx', 'num_batch', 'num_gpu', 'main_gpu', 'low_vram', 'use_mmap', 'use_mlock', 'num_thread')
+
+
+def load_options(options):
+    return {key: value for key, value in (options or {}).items() if key in LOAD_OPTIONS}
+
+
+class ModelState:
+    """
+    Residency of one model as far as the app knows. status is one of unloaded, loading, ready, failed.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.status = "unloaded"
+        self.error = None
+        self.last_used = 0.0
+        # Number of requests currently running with the model, it isn't unloaded while they run
+        self.active = 0
+        self.future = None
+        # LOAD_OPTIONS the model was (or is being) loaded with
+        self.options = None
+
+
+class ModelResidency:
+    """
+    Loads models before they are needed and frees them when nobody uses them. preload() loads a model in
+    the background with an empty generate request, so the first answer after selecting it doesn't pay the
+    load time, as long as it's preloaded with the options the answer is sent with (preload() loads it again
+    when they change). Requests send keep_alive(model) and are marked with begin()/end() or in_use(); a monitor on
+    the shared client loop unloads models that were idle for longer than their limit (keep_alive 0), so RAM is freed
+    on shared machines. Listeners are called with the ModelState whenever its status changes.
+    """
+
+    def __init__(self, idle_seconds=IDLE_UNLOAD_SECONDS):
+        self.idle_seconds = idle_seconds
+        # model -> idle limit in seconds, for models that don't use the default
+        self.idle_limits = {}
+        self.states = {}
+        self._listeners = []
+        self._monitor = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, state):
+        for listener in list(self._listeners):
+            listener(state)
+
+    def state(self, name):
+        with self._lock:
+            if name not in self.states:
+                self.states[name] = ModelState(name)
+            return self.states[name]
+
+    def idle_limit(self, name):
+        return self.idle_limits.get(name, self.idle_seconds)
+
+    def set_idle_limit(self, name, seconds):
+        if seconds == self.idle_seconds:
+            self.idle_limits.pop(name, None)
+        else:
+            self.idle_limits[name] = seconds
+
+    def keep_alive(self, name):
+        # keep_alive for requests with the model, None uses the server's default
+        limit = self.idle_limit(name)
+        return limit + KEEP_ALIVE_MARGIN if limit > 0 else None
+
+    def preload(self, name, options=None):
+        # options: what the next request with the model will send, e.g. its num_ctx
+        state = self.state(name)
+        if state.status in ("loading", "ready") and state.options == load_options(options):
+            return state
+        if state.active:
+            # A running request keeps the model loaded with its own options
+            return state
+        state.status = "loading"
+        state.error = None
+        state.options = load_options(options)
+        state.future = get_client().submit(self._load(state, options))
+        self._notify(state)
+        return state
+
+    def begin(self, name):
+        # A request with the model starts, it isn't unloaded until end(name)
+        state = self.state(name)
+        with self._lock:
+            state.active += 1
+            state.last_used = time.monotonic()
+
+    def end(self, name, loaded=True, options=None):
+        # loaded: the request reached the model, so Ollama has it in memory now, with the request's options
+        state = self.state(name)
+        with self._lock:
+            state.active -= 1
+            state.last_used = time.monotonic()
+        if loaded:
+            state.options = load_options(options)
+            if state.status != "ready":
+                state.status = "ready"
+                self._notify(state)
+        self._start_monitor()
+
+    @contextmanager
+    def in_use(self, name, options=None):
+        """
+        with model_residency.in_use(model, options): ... around a blocking request with the model.
+        """
+        self.begin(name)
+        loaded = False
+        try:
+            yield
+            loaded = True
+        finally:
+            self.end(name, loaded, options)
+
+    def unload(self, name):
+        # Returns a concurrent.futures.Future
+        return get_client().submit(self._unload(self.state(name)))
+
+    async def _load(self, state, options=None):
+        try:
+            await get_client().aio.generate(model=state.name, prompt="", options=options or None,
+                                            keep_alive=self.keep_alive(state.name))
+            if state.options != load_options(options):
+                # Another preload with other options was started in the meantime, it sets the status
+                return
+            state.status = "ready"
+            state.last_used = time.monotonic()
+            self._start_monitor()
+        except asyncio.CancelledError:
+            state.status = "unloaded"
+        except Exception as e:
+            state.status = "failed"
+            state.error = e
+        self._notify(state)
+
+    async def _unload(self, state):
+        try:
+            await get_client().aio.generate(model=state.name, prompt="", keep_alive=0)
+        except (ollama.ResponseError, httpx.HTTPError):
+            # e.g. the model was deleted, it isn't loaded either way
+            pass
+        state.status = "unloaded"
+        self._notify(state)
+
+    def _start_monitor(self):
+        with self._lock:
+            if self._monitor is None or self._monitor.done():
+                self._monitor = get_client().submit(self._watch())
+
+    async def _watch(self):
+        # Runs on the client loop as long as any model is loaded
+        while any(state.status == "ready" for state in list(self.states.values())):
+            await asyncio.sleep(CHECK_INTERVAL)
+            now = time.monotonic()
+            for state in list(self.states.values()):
+                limit = self.idle_limit(state.name)
+                if state.status == "ready" and not state.active and limit > 0 and now - state.last_used > limit:
+                    await self._unload(state)
+            await self._sync_loaded()
+
+    async def _sync_loaded(self):
+        # Models the server unloaded on its own (e.g. to make room for another one) aren't ready anymore
+        try:
+            response = await get_client().aio.ps()
+        except (ollama.ResponseError, httpx.HTTPError):
+            return
+        loaded = {model['name'] for model in response.get('models', [])}
+        for state in list(self.states.values()):
+            if state.status == "ready" and not state.active and state.name not in loaded:
+                state.status = "unloaded"
+                self._notify(state)
+
+
+model_residency = ModelResidency()
@@ -0,0 +1,67 @@
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+
+from bot.model_registry import model_registry
+from utils.disk_cache import DiskCache
+
+CACHE_DIR = os.path.join("cache", "responses")
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+# Sampling options that make an answer reproducible, set when the cache is switched on
+DETERMINISTIC_OPTIONS = {'temperature': 0, 'seed': 42}
+
+
+def is_deterministic(options):
+    return bool(options) and options.get('temperature') == 0 and options.get('seed') is not None
+
+
+def replay_parts(content):
+    # Splits a cached answer into word-sized pieces, so it can be streamed like a generated one
+    return re.findall(r'\s*\S+\s*|\s+', content)
+
+
+class ResponseCache(DiskCache):
+    """
+    On-disk cache of complete answers, with the same size-bounded LRU storage as the extraction cache.
+    The key covers everything that determines a deterministic answer: model name and digest, the
+    options of the request (including the fitted num_ctx) and the exact message list. Only used when
+    sampling is deterministic.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        super().__init__(cache_dir, max_bytes)
+
+    def key(self, model, options, messages):
+        # None if the answer can't be cached, e.g. the model digest isn't known yet
+        model_info = model_registry.get(model)
+        if not is_deterministic(options) or not model_info or not model_info['digest']:
+            return None
+        payload = json.dumps({'model': model, 'digest': model_info['digest'], 'options': options,
+                              'messages': [{'role': m['role'], 'content': m['content']} for m in messages]},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_response(self, key):
+        text = self.get(key)
+        return json.loads(text) if text is not None else None
+
+    def put_response(self, key, content):
+        self.put(key, json.dumps({'content': content, 'created': time.time()}))
+
+
+async def replay(entry):
+    """
+    Async iterator over chunks shaped like those of a streamed chat, so a cached answer goes through the
+    same code as a generated one.
+    """
+    for piece in replay_parts(entry['content']):
+        yield {'message': {'role': 'assistant', 'content': piece}, 'done': False}
+        # Gives the UI a chance to render in between
+        await asyncio.sleep(0)
+    yield {'message': {'role': 'assistant', 'content': ''}, 'done': True}
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,175 @@
+import os
+import re
+import json
+
+import numpy as np
+
+from bot.client import get_client
+
+EMBEDDING_MODEL = "nomic-embed-text"
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+TOP_K = 4
+EMBED_BATCH_SIZE = 32
+
+
+def _split_chunks(text, chunk_size, overlap, final=True):
+    # Returns the chunks and where the next one starts. Unless final, text may continue, so chunks are
+    # only cut where a full chunk_size window is available.
+    chunks = []
+    start = 0
+    while start < len(text):
+        if not final and start + chunk_size >= len(text):
+            break
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            window = text[start + chunk_size // 2:end]
+            boundary = max(window.rfind("\n"), *(m.end() for m in re.finditer(r"[.!?] ", window)), -1)
+            if boundary > 0:
+                end = start + chunk_size // 2 + boundary
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            start = len(text)
+            break
+        start = max(end - overlap, start + 1)
+    return chunks, start
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Splits text into chunks of about chunk_size characters that overlap by `overlap` characters.
+    Chunks end at a paragraph or sentence boundary when there is one in the second half of the chunk.
+    """
+    return _split_chunks(text, chunk_size, overlap)[0]
+
+
+def chunk_pages(pages, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Yields the same chunks as chunk_text over the joined pages, but only holds a few chunks worth of text
+    at a time, so a long document doesn't have to be read into memory to be indexed.
+    """
+    buffer = ""
+    for page in pages:
+        buffer += page
+        if len(buffer) >= 4 * chunk_size:
+            chunks, start = _split_chunks(buffer, chunk_size, overlap, final=False)
+            yield from chunks
+            buffer = buffer[start:]
+    yield from chunk_text(buffer, chunk_size, overlap)
+
+
+class VectorIndex:
+    """
+    Compact in-memory vector index for the chunks of one chat's documents. Vectors are stored
+    L2-normalized in a single float32 matrix, so a query is one matrix-vector product.
+    """
+
+    def __init__(self, embedding_model=EMBEDDING_MODEL):
+        self.embedding_model = embedding_model
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.chunks = []  # {"doc": content hash, "file": path, "text": chunk}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def documents(self):
+        return {chunk["doc"] for chunk in self.chunks}
+
+    def add(self, doc_id, file_path, texts, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) == 0:
+            return
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, 1e-12)
+        self.vectors = vectors if len(self.chunks) == 0 else np.vstack([self.vectors, vectors])
+        self.chunks.extend({"doc": doc_id, "file": file_path, "text": text} for text in texts)
+
+    def remove(self, doc_id):
+        keep = [i for i, chunk in enumerate(self.chunks) if chunk["doc"] != doc_id]
+        self.vectors = self.vectors[keep] if keep else np.zeros((0, 0), dtype=np.float32)
+        self.chunks = [self.chunks[i] for i in keep]
+
+    def search(self, query_vector, k=TOP_K, doc_ids=None):
+        """
+        Returns the k chunks with the highest cosine similarity as (score, chunk) pairs,
+        optionally restricted to the documents in doc_ids.
+        """
+        if len(self.chunks) == 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / max(np.linalg.norm(query), 1e-12)
+        scores = self.vectors @ query
+        if doc_ids is not None:
+            mask = np.array([chunk["doc"] in doc_ids for chunk in self.chunks])
+            scores = np.where(mask, scores, -np.inf)
+        k = min(k, len(self.chunks))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.chunks[i]) for i in top if np.isfinite(scores[i])]
+
+    def save(self, path):
+        meta = json.dumps({"embedding_model": self.embedding_model, "chunks": self.chunks})
+        tmp_path = path + ".tmp.npz"
+        np.savez(tmp_path, vectors=self.vectors, meta=np.array(meta))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, embedding_model=EMBEDDING_MODEL):
+        index = cls(embedding_model)
+        if not os.path.exists(path):
+            return index
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            # Vectors of another embedding model can't be compared with new queries
+            if meta["embedding_model"] != embedding_model:
+                return index
+            index.vectors = data["vectors"].astype(np.float32)
+            index.chunks = meta["chunks"]
+        return index
+
+
+class Retriever:
+    """
+    Chunks and embeds documents through Ollama's embeddings endpoint and picks the most relevant
+    chunks for a prompt.
+    """
+
+    def __init__(self, embedding_model=EMBEDDING_MODEL, top_k=TOP_K):
+        self.embedding_model = embedding_model
+        self.top_k = top_k
+        self.index = VectorIndex(embedding_model)
+
+    def embed(self, texts):
+        vectors = []
+        for i in range(0, len(texts), EMBED_BATCH_SIZE):
+            response = get_client().sync.embed(model=self.embedding_model, input=texts[i:i + EMBED_BATCH_SIZE])
+            vectors.extend(response["embeddings"])
+        return vectors
+
+    def add_document(self, doc_id, file_path, document):
+        # document: the attachment's Document from the extraction cache, read page by page
+        if doc_id in self.index.documents():
+            return
+        texts = list(chunk_pages(document.iter_pages()))
+        if texts:
+            self.index.add(doc_id, file_path, texts, self.embed(texts))
+
+    def remove_document(self, doc_id):
+        self.index.remove(doc_id)
+
+    def relevant_chunks(self, prompt, doc_ids=None):
+        if len(self.index) == 0:
+            return []
+        query_vector = self.embed([prompt])[0]
+        return [chunk for score, chunk in self.index.search(query_vector, self.top_k, doc_ids)]
+
+    def save(self, path):
+        self.index.save(path)
+
+    def load(self, path):
+        self.index = VectorIndex.load(path, self.embedding_model)
+
+    def reset(self):
+        self.index = VectorIndex(self.embedding_model)
@@ -0,0 +1,127 @@
+import os
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Number of requests Ollama works on at the same time, matches the server's OLLAMA_NUM_PARALLEL
+DEFAULT_SLOTS = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_MAX_QUEUE_PER_USER = 4
+
+
+class QueueFull(Exception):
+    pass
+
+
+class FairScheduler:
+    """
+    Admission control in front of Ollama. At most `slots` requests run at the same time, the rest wait in
+    one queue per user. Free slots are handed out round-robin between users, so a user with many requests
+    can't starve the others. Waiters are told their position in the queue whenever it changes.
+    Has to be used from a single event loop (Flet runs all sessions on one loop).
+    """
+
+    def __init__(self, slots=DEFAULT_SLOTS, max_queue=DEFAULT_MAX_QUEUE, max_queue_per_user=DEFAULT_MAX_QUEUE_PER_USER):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.active = 0
+        # user -> deque of (future, on_position), the dict order is the round-robin order
+        self.queues = {}
+
+    @property
+    def queued(self):
+        return sum(len(waiters) for waiters in self.queues.values())
+
+    @asynccontextmanager
+    async def slot(self, user_id, on_position=None):
+        """
+        async with scheduler.slot(user_id, on_position): ...
+        on_position(position) is called with the 1-based queue position while waiting, and with 0 once the
+        request runs. Raises QueueFull if the queue is at its limit.
+        """
+        if self.active < self.slots and not self.queues:
+            self.active += 1
+        else:
+            await self._wait(user_id, on_position)
+        if on_position:
+            on_position(0)
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._dispatch()
+
+    async def _wait(self, user_id, on_position):
+        if self.queued >= self.max_queue or len(self.queues.get(user_id, ())) >= self.max_queue_per_user:
+            raise QueueFull("Too many requests are waiting, please try again in a moment.")
+        future = asyncio.get_running_loop().create_future()
+        waiter = (future, on_position)
+        self.queues.setdefault(user_id, deque()).append(waiter)
+        self._notify_positions()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was already handed to this waiter, give it back
+                self.active -= 1
+                self._dispatch()
+            else:
+                self._remove(user_id, waiter)
+                self._notify_positions()
+            raise
+
+    def _remove(self, user_id, waiter):
+        waiters = self.queues.get(user_id)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del self.queues[user_id]
+
+    def _dispatch(self):
+        while self.active < self.slots and self.queues:
+            # Take the first waiter of the next user, then move that user to the end of the rotation
+            user_id = next(iter(self.queues))
+            waiters = self.queues.pop(user_id)
+            future, on_position = waiters.popleft()
+            if waiters:
+                self.queues[user_id] = waiters
+            if future.cancelled():
+                continue
+            self.active += 1
+            future.set_result(None)
+        self._notify_positions()
+
+    def positions(self):
+        # Order in which the waiters will get a slot, following the round-robin between users
+        order = []
+        queues = [list(waiters) for waiters in self.queues.values()]
+        depth = 0
+        while any(depth < len(waiters) for waiters in queues):
+            order.extend(waiters[depth] for waiters in queues if depth < len(waiters))
+            depth += 1
+        return order
+
+    def _notify_positions(self):
+        for position, (future, on_position) in enumerate(self.positions(), start=1):
+            if on_position and not future.done():
+                on_position(position)
+
+
+_scheduler = None
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = FairScheduler()
+    return _scheduler
+
+
+def configure_scheduler(**kwargs):
+    """
+    Replaces the shared scheduler, e.g. configure_scheduler(slots=2, max_queue=20) for a team server.
+    """
+    global _scheduler
+    _scheduler = FairScheduler(**kwargs)
+    return _scheduler
@@ -0,0 +1,146 @@
+import os
+import math
+import threading
+
+from bot.model_registry import model_registry
+from bot.prompt_builder import PDF_INSTRUCTIONS, SYSTEM_PROMPT, RETRIEVAL_PROMPT, SUMMARY_HEADER
+from bot.retrieval import CHUNK_SIZE, TOP_K
+
+# Context window Ollama uses when no num_ctx is sent, newer servers read it from OLLAMA_CONTEXT_LENGTH
+DEFAULT_NUM_CTX = int(os.getenv("OLLAMA_CONTEXT_LENGTH", "2048"))
+# Rough estimate for unknown tokenizers, about 4 characters per token for English text
+CHARS_PER_TOKEN = 4
+# Characters per token by tokenizer type (tokenizer.ggml.model of the show endpoint). BPE tokenizers with a
+# large vocabulary (Llama 3, Qwen) pack more text into a token than SentencePiece ones (Llama 2, Mistral).
+TOKENIZER_CHARS_PER_TOKEN = {'gpt2': 4.0, 'llama': 3.5}
+# Role and chat template tokens around every message
+MESSAGE_OVERHEAD_TOKENS = 4
+# Tokens kept free for the answer when num_ctx is chosen
+ANSWER_RESERVE_TOKENS = 1024
+
+
+def model_limits(model, fetch=True):
+    """
+    Returns (context length, characters per token) of a model from the registry's details, which are
+    fetched once per model digest. The context length is None if it isn't known.
+    With fetch=False only details that were fetched already are used, nothing blocks.
+    """
+    if fetch:
+        try:
+            details = model_registry.details(model)
+        except Exception:
+            # Ollama not reachable, the defaults are the best guess
+            details = {}
+    else:
+        details = model_registry.cached_details(model) or {}
+    chars_per_token = TOKENIZER_CHARS_PER_TOKEN.get(details.get('tokenizer'), CHARS_PER_TOKEN)
+    return details.get('context_length'), chars_per_token
+
+
+def to_tokens(chars, messages, chars_per_token):
+    return math.ceil(chars / chars_per_token) + messages * MESSAGE_OVERHEAD_TOKENS
+
+
+def messages_tokens(model, messages):
+    # Estimated size of a built message list, e.g. the one about to be sent
+    context_length, chars_per_token = model_limits(model)
+    return to_tokens(sum(len(message['content']) for message in messages), len(messages), chars_per_token)
+
+
+def format_tokens(tokens):
+    return f"{tokens / 1000:.1f}k" if tokens >= 1000 else str(tokens)
+
+
+def fit_num_ctx(tokens, context_length=None):
+    """
+    Smallest context window that holds the prompt and ANSWER_RESERVE_TOKENS, capped at the model's context
+    length. Windows double from DEFAULT_NUM_CTX, so there are only a few distinct sizes: Ollama reloads
+    the model whenever num_ctx changes.
+    """
+    num_ctx = DEFAULT_NUM_CTX
+    while num_ctx < tokens + ANSWER_RESERVE_TOKENS and (not context_length or num_ctx < context_length):
+        num_ctx *= 2
+    return min(num_ctx, context_length) if context_length else num_ctx
+
+
+def request_options(model, messages, options=None):
+    """
+    Options of a request with messages: options, and unless num_ctx is set there, a context window that
+    fits the messages and leaves room for the answer. Ollama's default window silently cuts long prompts.
+    """
+    options = dict(options or {})
+    if 'num_ctx' not in options:
+        context_length, _ = model_limits(model)
+        options['num_ctx'] = fit_num_ctx(messages_tokens(model, messages), context_length)
+    return options
+
+
+def context_window(model, num_ctx=None):
+    """
+    Largest window a request of the chat can get: num_ctx if it's set in the options, otherwise the
+    model's context length, which fit_num_ctx grows the request's window up to. Capped at the context
+    length; if that isn't known, Ollama's default window is the safe guess.
+    """
+    context_length, _ = model_limits(model)
+    num_ctx = num_ctx or context_length or DEFAULT_NUM_CTX
+    return min(num_ctx, context_length) if context_length else num_ctx
+
+
+class PromptCounter:
+    """
+    Incremental size estimate of the next request of one chat, cheap enough to run on every keystroke.
+    Character counts of the history are kept as prefix sums, so only messages added since the last call
+    are counted. The size of an attached file comes from its Document, without reading the text.
+    Counts are kept in characters and converted with the model's tokenizer ratio at the end, so switching
+    models doesn't recount anything.
+    """
+
+    def __init__(self):
+        self._history = None
+        self._prefix = [0]
+        self._files_key = None
+        self._files_chars = 0
+        self._lock = threading.Lock()
+
+    def history_chars(self, history, start=0):
+        # Characters of history[start:]. The history is append-only, another list starts a new count
+        if history is not self._history or len(history) < len(self._prefix) - 1:
+            self._history = history
+            self._prefix = [0]
+        for message in history[len(self._prefix) - 1:]:
+            self._prefix.append(self._prefix[-1] + len(message['content']))
+        return self._prefix[-1] - self._prefix[min(start, len(self._prefix) - 1)]
+
+    def files_chars(self, processed_files, retrieval=False):
+        # Size of the system message with the file context, like PromptBuilder it only changes with the files
+        key = (retrieval, tuple(file['file'] for file in processed_files))
+        if key != self._files_key:
+            if not processed_files:
+                chars = 0
+            elif retrieval:
+                # The file list, plus the excerpts that go into the last message
+                chars = len(RETRIEVAL_PROMPT) + sum(len(file['file']) + 3 for file in processed_files) + TOP_K * CHUNK_SIZE
+            else:
+                chars = len(SYSTEM_PROMPT) + sum(len(PDF_INSTRUCTIONS) + len(file['file']) + 40 + file['document'].size
+                                                 for file in processed_files)
+            self._files_key = key
+            self._files_chars = chars
+        return self._files_chars
+
+    def estimate(self, model, history, prompt, processed_files=(), summary=None, start=0, retrieval=False, num_ctx=None):
+        """
+        history[start:] is sent after the summary (compaction). num_ctx: window set in the options, if any.
+        Returns {'tokens', 'num_ctx', 'max_ctx'}: the estimated prompt size, the window the request will
+        use and the largest window available. Past max_ctx, Ollama cuts off the beginning of the prompt.
+        Only already fetched model details are used, see ModelRegistry.prefetch_details().
+        """
+        context_length, chars_per_token = model_limits(model, fetch=False)
+        with self._lock:
+            chars = self.files_chars(processed_files, retrieval) + self.history_chars(history, start) + len(prompt)
+        if summary:
+            chars += len(SUMMARY_HEADER) + len(summary)
+        messages = len(history) - start + 1 + bool(processed_files) + bool(summary)
+        tokens = to_tokens(chars, messages, chars_per_token)
+        request_ctx = num_ctx or fit_num_ctx(tokens, context_length)
+        # Without a known context length, Ollama caps the window at the model's limit on its own
+        return {'tokens': tokens, 'num_ctx': request_ctx, 'max_ctx': num_ctx or context_length or request_ctx}
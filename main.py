@@ -1,14 +1,90 @@
-from bot.ollama_integration import OllamaCall
-from ui.chatbot_ui import ChatbotUI
+from utils.startup import startup_timer
+from bot.scheduler import configure_scheduler
 import flet as ft
-import ollama
-from utils import utils
-import asyncio
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import uuid
+
+# Set by --serve: every browser gets its own user id and chat folder
+SERVER_MODE = False
+# uuid4().hex
+USER_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+async def user_session(page: ft.Page):
+    """
+    Returns (user id, chat folder) of the session. In server mode the id is kept in the browser's
+    local storage, so a user finds their chats again, and chats of different users are stored apart.
+    """
+    if not SERVER_MODE:
+        return "local", "saved_chats"
+    # The async calls, the blocking ones would wait for the client's reply on the loop that delivers it
+    user_id = await page.client_storage.get_async("ollamaui.user_id")
+    # The stored value comes from the browser, only ids in the format generated here name a chat folder
+    if not isinstance(user_id, str) or not USER_ID_PATTERN.fullmatch(user_id):
+        user_id = uuid.uuid4().hex
+        await page.client_storage.set_async("ollamaui.user_id", user_id)
+    return user_id, os.path.join("saved_chats", "users", user_id)
+
+
+def preload():
+    """
+    Imports the app modules (ollama, httpx, numpy, ...) while Flet starts its window, so they're loaded
+    when main() needs them. PyMuPDF isn't part of it, it's imported with the first attached PDF.
+    """
+    import bot.ollama_integration
+    import ui.chatbot_ui
+    startup_timer.mark("imports_done")
+
+
 async def main(page: ft.Page):
-    await utils.setup(page)
-    chatbot = OllamaCall("llama3.2:latest")
-    UI = ChatbotUI(page, chatbot=chatbot)
-    chatbot.UI = UI
+    startup_timer.mark("window_connected")
+    # Waits for preload() if it's still running
+    from bot.ollama_integration import OllamaCall
+    from ui.chatbot_ui import ChatbotUI
+    from ui.setup_dialog import setup
+    user_id, chat_folder = await user_session(page)
+    chatbot = OllamaCall("llama3.2:latest", chat_folder=chat_folder, user_id=user_id)
+    # The window is drawn first, the model list and the saved chats are filled in as they arrive
+    ChatbotUI(page, chatbot=chatbot)
+    page.run_task(setup, page, chatbot.model, chatbot.preload_options())
+
+
+def print_startup_report(report):
+    # --benchmark-startup: print the milestones and quit once the app is interactive
+    print(json.dumps(report, indent=2))
+    sys.stdout.flush()
+    os._exit(0)
+
 
 if __name__ == "__main__":
-    ft.app(target=lambda p: asyncio.run(main(p)))
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="OllamaUI")
+    parser.add_argument("--serve", action="store_true", help="serve the app to several users in the browser")
+    parser.add_argument("--host", default=None, help="address to listen on in server mode")
+    parser.add_argument("--port", type=int, default=8550, help="port to listen on in server mode")
+    parser.add_argument("--slots", type=int, default=None,
+                        help="requests sent to Ollama at the same time, should match OLLAMA_NUM_PARALLEL")
+    parser.add_argument("--max-queue", type=int, default=64, help="maximum number of waiting requests")
+    parser.add_argument("--max-queue-per-user", type=int, default=4, help="maximum number of waiting requests per user")
+    parser.add_argument("--benchmark-startup", action="store_true",
+                        help="print the time to first paint and to the first interactive state, then exit")
+    args = parser.parse_args()
+
+    if args.benchmark_startup:
+        startup_timer.on_interactive = print_startup_report
+    threading.Thread(target=preload, daemon=True).start()
+
+    if args.serve:
+        SERVER_MODE = True
+        scheduler_options = {"max_queue": args.max_queue, "max_queue_per_user": args.max_queue_per_user}
+        if args.slots:
+            scheduler_options["slots"] = args.slots
+        configure_scheduler(**scheduler_options)
+        ft.app(target=main, view=ft.AppView.WEB_BROWSER, host=args.host, port=args.port)
+    else:
+        # main runs on Flet's own event loop, which also runs the generation tasks
+        ft.app(target=main)
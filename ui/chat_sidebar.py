@@ -0,0 +1,155 @@
+import flet as ft
+
+from utils import utils
+
+PAGE_SIZE = 50
+# Distance in pixels from the end of the list at which the next page is loaded
+LOAD_MORE_THRESHOLD = 300
+SEARCH_LIMIT = 50
+
+
+class ChatSidebar:
+    """
+    Sidebar list of saved chats. Rows come from the sidebar index of the chat store, page by page:
+    only the first PAGE_SIZE buttons are built, more are added when the user scrolls to the end.
+    Creating, renaming and deleting a chat updates only the affected row.
+    While the search box isn't empty, the list shows the ranked full-text hits instead.
+    """
+
+    def __init__(self, page: ft.Page, on_open, width=200, chat_folder="saved_chats"):
+        self.page = page
+        self.chat_folder = chat_folder
+        # on_open(chat_name, message_seq=None)
+        self.on_open = on_open
+        self.buttons = {}
+        self.loaded = 0
+        self.exhausted = False
+        self.query = ""
+        self.list_view = ft.ListView(width=width, expand=True, on_scroll=self.handle_scroll, on_scroll_interval=100)
+        self.search_field = ft.TextField(
+            hint_text="Search chats", prefix_icon=ft.icons.SEARCH, width=width, dense=True,
+            on_change=self.handle_search, on_submit=self.handle_search,
+        )
+        # Shown until the first page is loaded in the background
+        self.list_view.controls.append(ft.Text("Loading chats...", color="grey"))
+
+    def create_button(self, entry):
+        return ft.TextButton(
+            entry["name"],
+            tooltip=self.tooltip(entry),
+            on_click=lambda e, f=entry["name"]: self.on_open(f),  # Pass chat name to the function
+            data=entry["name"],
+        )
+
+    def tooltip(self, entry):
+        return f"{entry['message_count']} messages\n{entry['preview']}" if entry["preview"] else None
+
+    def refresh(self):
+        # Rebuilds the list from the first page
+        self.list_view.controls.clear()
+        self.buttons = {}
+        self.loaded = 0
+        self.exhausted = False
+        self.load_more(update=False)
+        self.page.update()
+
+    def load_more(self, update=True):
+        if self.exhausted:
+            return
+        entries = utils.load_chat_entries(self.loaded, PAGE_SIZE, self.chat_folder)
+        self.loaded += len(entries)
+        self.exhausted = len(entries) < PAGE_SIZE
+        self.remove_placeholder()
+        for entry in entries:
+            # A chat created during this session may already be in the list
+            if entry["name"] in self.buttons:
+                continue
+            button = self.create_button(entry)
+            self.buttons[entry["name"]] = button
+            self.list_view.controls.append(button)
+        if not self.list_view.controls:
+            self.list_view.controls.append(ft.Text("No saved chats found.", color="grey"))
+        if update:
+            self.page.update()
+
+    def remove_placeholder(self):
+        self.list_view.controls = [control for control in self.list_view.controls if isinstance(control, ft.TextButton)]
+
+    def handle_scroll(self, e: ft.OnScrollEvent):
+        if not self.query and e.max_scroll_extent - e.pixels < LOAD_MORE_THRESHOLD:
+            self.load_more()
+
+    def handle_search(self, e):
+        query = self.search_field.value.strip()
+        if query == self.query:
+            return
+        self.query = query
+        if not query:
+            # Back to the chat list, rebuilt since it may have changed during the search
+            self.refresh()
+            return
+        self.show_results(utils.search_chats(query, SEARCH_LIMIT, self.chat_folder))
+
+    def show_results(self, hits):
+        self.list_view.controls = [self.create_result(hit) for hit in hits]
+        if not hits:
+            self.list_view.controls.append(ft.Text("No matches found.", color="grey"))
+        self.page.update()
+
+    def create_result(self, hit):
+        # The snippet marks the matched terms with **, so they are highlighted by the Markdown control
+        return ft.Container(
+            content=ft.Column(
+                [
+                    ft.Text(hit["name"], weight=ft.FontWeight.BOLD, max_lines=1, overflow=ft.TextOverflow.ELLIPSIS),
+                    ft.Markdown(f"*{hit['role']}:* {hit['snippet']}"),
+                ],
+                spacing=2,
+            ),
+            padding=ft.padding.symmetric(vertical=4, horizontal=8),
+            border_radius=6,
+            ink=True,
+            on_click=lambda e, name=hit["name"], seq=hit["seq"]: self.on_open(name, seq),
+        )
+
+    def chat_added(self, chat_name):
+        # New or updated chats move to the top, like in the store's order
+        if self.query:
+            return
+        entry = utils.load_chat_entry(chat_name, self.chat_folder)
+        if entry is None:
+            return
+        self.remove_placeholder()
+        button = self.buttons.pop(chat_name, None)
+        if button is not None:
+            self.list_view.controls.remove(button)
+            button.tooltip = self.tooltip(entry)
+        else:
+            button = self.create_button(entry)
+            self.loaded += 1
+        self.buttons[chat_name] = button
+        self.list_view.controls.insert(0, button)
+        self.page.update()
+
+    def chat_renamed(self, old_name, new_name):
+        if self.query:
+            return
+        button = self.buttons.pop(old_name, None)
+        if button is None:
+            return self.chat_added(new_name)
+        button.text = new_name
+        button.data = new_name
+        button.on_click = lambda e, f=new_name: self.on_open(f)
+        self.buttons[new_name] = button
+        self.page.update()
+
+    def chat_removed(self, chat_name):
+        if self.query:
+            return self.show_results(utils.search_chats(self.query, SEARCH_LIMIT, self.chat_folder))
+        button = self.buttons.pop(chat_name, None)
+        if button is not None:
+            self.list_view.controls.remove(button)
+            self.loaded -= 1
+        if not self.list_view.controls:
+            self.list_view.controls.append(ft.Text("No saved chats found.", color="grey"))
+        self.page.update()
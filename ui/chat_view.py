@@ -0,0 +1,89 @@
+import flet as ft
+
+from utils import utils
+
+PAGE_SIZE = 50
+# Distance in pixels from the top or the end of the list at which the next page is rendered
+LOAD_MORE_THRESHOLD = 200
+
+
+class ChatView:
+    """
+    Chat transcript with one Markdown control per message in a ListView, which only builds the rows that
+    are on screen. The view renders a window of the chat's history (the list the bot keeps, so the chat is
+    read once): the last PAGE_SIZE messages when a chat is opened, older pages are added on top when the
+    user scrolls up. Opened at a search hit, the window starts at the hit and newer pages follow below.
+    Messages of the running session are added with add_message().
+    """
+
+    def __init__(self, page: ft.Page):
+        self.page = page
+        self.messages = []
+        # The window [first_seq, last_seq) of self.messages is rendered
+        self.first_seq = 0
+        self.last_seq = 0
+        # True while the window reaches the end of the history, messages added later are rendered live
+        self.following = True
+        self.list_view = ft.ListView(expand=True, spacing=4, on_scroll=self.handle_scroll, on_scroll_interval=100)
+
+    def message_control(self, value, seq=None):
+        return ft.Markdown(value, selectable=True, extension_set=ft.MarkdownExtensionSet.GITHUB_WEB,
+                           key=f"message-{seq}" if seq is not None else None)
+
+    def render(self, start, end):
+        return [self.message_control(utils.format_messages([message]), seq)
+                for seq, message in enumerate(self.messages[start:end], start)]
+
+    def show(self, messages, message_seq=None):
+        """
+        messages: the chat's full history. Renders its last page, or the page starting at message_seq.
+        """
+        self.messages = messages
+        if message_seq is None:
+            self.last_seq = len(messages)
+            self.first_seq = max(0, self.last_seq - PAGE_SIZE)
+        else:
+            self.first_seq = message_seq
+            self.last_seq = min(len(messages), message_seq + PAGE_SIZE)
+        self.following = self.last_seq >= len(messages)
+        self.list_view.controls = self.render(self.first_seq, self.last_seq)
+        self.page.update()
+        if message_seq is not None:
+            self.list_view.scroll_to(key=f"message-{message_seq}", duration=300)
+        else:
+            self.list_view.scroll_to(offset=-1, duration=0)
+
+    def handle_scroll(self, e: ft.OnScrollEvent):
+        if e.pixels < LOAD_MORE_THRESHOLD and self.first_seq > 0:
+            self.load_older()
+        elif e.max_scroll_extent - e.pixels < LOAD_MORE_THRESHOLD and not self.following:
+            self.load_newer()
+
+    def load_older(self):
+        start = max(0, self.first_seq - PAGE_SIZE)
+        anchor = f"message-{self.first_seq}"
+        self.list_view.controls[0:0] = self.render(start, self.first_seq)
+        self.first_seq = start
+        self.page.update()
+        # Keeps the message the user was looking at in place
+        self.list_view.scroll_to(key=anchor, duration=0)
+
+    def load_newer(self):
+        end = min(len(self.messages), self.last_seq + PAGE_SIZE)
+        self.list_view.controls.extend(self.render(self.last_seq, end))
+        self.last_seq = end
+        self.following = end >= len(self.messages)
+        self.page.update()
+
+    def add_message(self, value):
+        """
+        Adds a message of the running session below the history and returns its control, e.g. to stream into.
+        """
+        if not self.following:
+            # Looking at an older part of the chat (search hit), new messages belong below the latest ones
+            self.show(self.messages)
+        control = self.message_control(value)
+        self.list_view.controls.append(control)
+        self.page.update()
+        self.list_view.scroll_to(offset=-1, duration=200)
+        return control
@@ -1,27 +1,58 @@
 import flet as ft
-import ollama
 import asyncio
-import os
+from bot.model_registry import model_registry, format_size
+from bot.downloads import download_manager
+from bot.residency import model_residency
+from bot.events import ChatEvents
 from utils import utils
-
-
-class ChatbotUI:
-    def __init__(self, page: ft.Page, chatbot ):
+from ui.stream_renderer import StreamRenderer
+from ui.chat_sidebar import ChatSidebar
+from ui.chat_view import ChatView
+from ui.download_panel import DownloadPanel
+from ui.compare_panel import ComparePanel
+from bot.scheduler import QueueFull
+from bot.tokens import ANSWER_RESERVE_TOKENS, format_tokens
+from utils.startup import startup_timer
+from utils.ingestion import SUPPORTED_EXTENSIONS
+
+
+# Text and color of the indicator next to the model selection, per residency status
+MODEL_STATUS_TEXT = {
+    "unloaded": ("Not loaded", "grey"),
+    "loading": ("Loading...", "grey"),
+    "ready": ("Ready", "green"),
+    "failed": ("Failed to load", "red"),
+}
+# Idle limits offered in the settings, in seconds
+IDLE_OPTIONS = [("300", "After 5 minutes"), ("900", "After 15 minutes"), ("3600", "After 1 hour"),
+                ("0", "Server default")]
+
+
+class ChatbotUI(ChatEvents):
+    def __init__(self, page: ft.Page, chatbot, stream_fps=25):
         self.page = page
-        page.on_disconnect = self.page.pubsub.unsubscribe_all()
+        page.on_disconnect = self.handle_disconnect
         self.chatbot = chatbot
+        # The engine reports saved chats, resets and attachment progress through the ChatEvents methods
+        chatbot.subscribe(self)
         self.page.title = "Chatbot"
         self.page.theme_mode = ft.ThemeMode.LIGHT
         self.page.horizontal_alignment = ft.CrossAxisAlignment.CENTER
-        self.chat_content = ""
-        self.chat_display = ft.Markdown(self.chat_content, selectable=True, extension_set=ft.MarkdownExtensionSet.GITHUB_WEB,
-                                        expand=True)
+        # One control per message, only the last page of a chat is rendered up front
+        self.chat_view = ChatView(self.page)
         self.file_chips = ft.Row(spacing=10)
+        # Maximum number of updates per second while an answer is streamed
+        self.stream_fps = stream_fps
 
-        # Create model list for dropdown model selection
-        model_list = [model['name'] for model in ollama.list()['models']]
-        model_list.append("Add new model")
-        self.model_options = [ft.dropdown.Option(model) for model in model_list]
+        # Create model list for dropdown model selection from the registry cache, it's updated in place when
+        # the list of installed models changes
+        self.model_options = self.create_model_options(model_registry.models)
+        self.model_checkboxes = None
+        self.download_panel = None
+        self.compare_panel = None
+        model_registry.subscribe(self.models_changed)
+        model_registry.refresh_in_background()
+        model_residency.subscribe(self.model_state_changed)
 
 
 
@@ -37,6 +68,14 @@ class ChatbotUI:
             on_change=self.handle_model_change
 
         )
+        # Loading/ready indicator of the selected model
+        self.model_status = ft.Row([ft.ProgressRing(width=14, height=14, stroke_width=2), ft.Text(size=12)], spacing=6)
+        self.show_model_state(model_residency.state(chatbot.model), update=False)
+
+        # Idle time after which the selected model is unloaded to free its memory
+        self.idle_dropdown = ft.Dropdown(label="Unload model when idle", value=self.idle_option(), width=220,
+                                         options=[ft.dropdown.Option(key, text) for key, text in IDLE_OPTIONS],
+                                         on_change=self.change_idle_limit)
 
         # Define a PopupMenuButton for settings
 
@@ -45,23 +84,22 @@ class ChatbotUI:
             items=[
                 ft.PopupMenuItem(text="Models", icon="smart_toy" , on_click = lambda e: self.manage_models() ),
                 ft.PopupMenuItem(text="Chats", icon="chat" ,on_click = lambda e: self.manage_chats()),
+                ft.PopupMenuItem(text="Compare models", icon="compare_arrows", on_click=lambda e: self.compare_models()),
                 ft.PopupMenuItem(),  # Separator
                 ft.PopupMenuItem(content= ft.Switch(label="Dark mode", value=self.page.theme_mode == ft.ThemeMode.DARK, on_change=self.toggle_dark_mode)),
+                ft.PopupMenuItem(content= ft.Switch(label="Document retrieval", value=self.chatbot.use_retrieval, on_change=self.toggle_retrieval)),
+                ft.PopupMenuItem(content= ft.Switch(label="Compact long chats", value=self.chatbot.use_compaction, on_change=self.toggle_compaction)),
+                ft.PopupMenuItem(content=self.idle_dropdown),
+                ft.PopupMenuItem(content= ft.Switch(label="Cache answers", tooltip="Deterministic sampling, repeated prompts are answered from the cache",
+                                                    value=self.chatbot.use_response_cache, on_change=self.toggle_response_cache)),
             ],
 
         )
 
 
-        # Scrollable column to hold the Markdown content
-        Markdown_column = ft.Column(
-            [self.chat_display],
-            expand=True
-        )
-        Markdown_column.scroll = "auto"
-
         # Scrollable container for chat display
-        chat_container = ft.Container(
-            content=Markdown_column,
+        self.chat_container = ft.Container(
+            content=self.chat_view.list_view,
             expand=True,
             padding=ft.padding.all(10),
             border=ft.border.all(1, "lightgrey"),
@@ -72,33 +110,36 @@ class ChatbotUI:
         )
 
 
-        # Sidebar for saved chats
-        self.chat_sidebar = ft.Column(
-            width=200,  # Set a fixed width for the sidebar
-            expand = True
-
-        )
-        self.chat_sidebar.scroll = "auto" #allow to scroll thorugh chats
+        # Sidebar for saved chats, loaded page by page from the sidebar index
+        self.sidebar = ChatSidebar(self.page, on_open=self.open_chat, width=200, chat_folder=chatbot.chat_folder)
+        self.chat_sidebar = self.sidebar.list_view
 
 
-        self.load_chat_files()
         # UI components
-        self.upload_file_button = ft.IconButton(icon="attach_file", on_click=lambda _: self.file_picker.pick_files(allowed_extensions=["pdf"], allow_multiple=True))
-        self.user_input = ft.TextField(label="Type your message", expand=True, on_submit=lambda _: self.handle_send_message())
+        self.upload_file_button = ft.IconButton(icon="attach_file", on_click=lambda _: self.file_picker.pick_files(allowed_extensions=sorted(extension[1:] for extension in SUPPORTED_EXTENSIONS), allow_multiple=True))
+        self.user_input = ft.TextField(label="Type your message", expand=True, on_submit=lambda _: self.handle_send_message(),
+                                       on_change=lambda _: self.update_prompt_size())
+        # Estimated size of the next request against the model's context window
+        self.prompt_size = ft.Text("", size=12, color="grey")
         self.send_button = ft.ElevatedButton("Send", on_click=lambda _: self.handle_send_message())
+        self.stop_button = ft.ElevatedButton("Stop", icon=ft.icons.STOP, visible=False, on_click=self.stop_generation)
+        # Task of the answer that is currently generated
+        self.generation_task = None
+        # True from the moment a prompt is submitted until its answer is done, the task only exists once it runs
+        self.generating = False
         self.new_chat_button = ft.ElevatedButton("New Chat", on_click=lambda e: self.chatbot.new_chat())
 
         # Layout structure
         self.page.add(
             ft.Row(
                 [
-                    ft.Column([self.new_chat_button, self.chat_sidebar]),  # Sidebar on the left
+                    ft.Column([self.new_chat_button, self.sidebar.search_field, self.chat_sidebar]),  # Sidebar on the left
                     ft.Column(
                         [
-                            ft.Row([ft.Text("Chatbot", style="headlineMedium", color="purple"), self.model_dropdown, self.settings_menu], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
-                            chat_container,  # Scrollable chat container
+                            ft.Row([ft.Text("Chatbot", style="headlineMedium", color="purple"), ft.Row([self.model_dropdown, self.model_status]), self.settings_menu], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+                            self.chat_container,  # Scrollable chat container
                             self.file_chips,
-                            ft.Row([self.upload_file_button, self.user_input, self.send_button], alignment=ft.MainAxisAlignment.END)
+                            ft.Row([self.upload_file_button, self.user_input, self.prompt_size, self.send_button, self.stop_button], alignment=ft.MainAxisAlignment.END)
                         ],
                         expand=True,
                     )
@@ -107,6 +148,10 @@ class ChatbotUI:
             )
         )
         self.page.update()
+        startup_timer.mark("first_paint")
+        # The window is usable now, saved chats are read in the background while the model list loads
+        self.page.run_thread(self.load_chat_files)
+        self.prefetch_model_details()
 
 
     def upload_files(self, e):
@@ -125,31 +170,35 @@ class ChatbotUI:
 
 
     def process_files(self, file_paths):
-        # disable send
-        self.send_button.disabled = True
-        self.user_input.on_submit = None
-        self.page.update()
-
-        for file_path in file_paths:
-            chip = self.create_file_chip(file_path)
-            self.file_chips.controls.append(chip)
+        # Files are processed in the background, the user can keep typing in the meantime
+        self.chatbot.upload_files(file_paths)
 
+    def file_added(self, file_path):
+        self.file_chips.controls.append(self.create_file_chip(file_path))
         self.page.update()
-        for file_path in file_paths:
-            # process file
-            self.chatbot.upload_file(file_path)
 
-            # update chip icon to "check"
-            chip = next((chip for chip in self.file_chips.controls if chip.data == file_path), None)
-            if chip:
-                chip.leading = ft.Icon(ft.icons.CHECK, color="green")
-                self.page.update()
+    def find_file_chip(self, file_path):
+        return next((chip for chip in self.file_chips.controls if chip.data == file_path), None)
 
-        # Enable send again
+    def file_progress(self, file_path, done_pages, total_pages):
+        chip = self.find_file_chip(file_path)
+        if chip:
+            chip.leading = ft.ProgressRing(value=done_pages / total_pages, width=16, height=16, stroke_width=2)
+            chip.tooltip = f"{done_pages}/{total_pages} pages processed"
+            self.page.update()
 
-        self.send_button.disabled = False
-        self.user_input.on_submit = lambda _: self.handle_send_message()
-        self.page.update()
+    def file_processed(self, file_path, error):
+        # update chip icon to "check", or "error" if the file couldn't be read
+        chip = self.find_file_chip(file_path)
+        if chip:
+            if error is None:
+                chip.leading = ft.Icon(ft.icons.CHECK, color="green")
+                chip.tooltip = None
+            else:
+                chip.leading = ft.Icon(ft.icons.ERROR_OUTLINE, color="red")
+                chip.tooltip = f"Could not read file: {error}"
+            self.page.update()
+        self.update_prompt_size()
 
 
 
@@ -174,12 +223,10 @@ class ChatbotUI:
     def remove_file_chip(self, chip, file_path):
         # Remove chip from UI and delete the corresponding file entry
         self.file_chips.controls.remove(chip)
-        if file_path in self.chatbot.files:
-            self.chatbot.processed_files = [entry for entry in self.chatbot.processed_files if entry["file"] != file_path]
-            self.chatbot.files.remove(file_path)
-            utils.store_submitted_files(self.chatbot.files, self.chatbot.name_current_chat)
+        self.chatbot.remove_file(file_path)
 
         self.page.update()
+        self.update_prompt_size()
 
     def manage_models(self):
         def change_box(e):
@@ -188,31 +235,22 @@ class ChatbotUI:
             self.page.update()
 
         def delete_models(e):
+            # The dialog and the dropdown are updated by the registry notification
             utils.delete_models(e)
-            model_list = [model['name'] for model in ollama.list()['models']]
+            delete_button.disabled = True
 
-            # Update the dialog content with the new checkboxes
-            self.checkboxes = [ft.Checkbox(label=model, value=False, on_change=change_box) for model in model_list]
-            model_dialog_content.controls = self.checkboxes
-            self.model_dialog.update()
-
-            # Update the dropdown options
-            model_list.append("Add new model")
-            self.model_options = [ft.dropdown.Option(model) for model in model_list]
-            self.model_dropdown.options = self.model_options
-            self.page.update()
-
-        model_list = [model['name'] for model in ollama.list()['models']]
-        self.checkboxes = [ft.Checkbox(label=model, value=False, on_change= change_box) for model in model_list]
+        self.model_checkbox_change = change_box
+        self.checkboxes = self.create_model_checkboxes(model_registry.models)
 
         model_dialog_content = ft.Column(
             self.checkboxes
         )
         model_dialog_content.scroll = "auto"
+        self.model_checkboxes = model_dialog_content
 
         delete_button = ft.TextButton("Delete", icon="delete", icon_color="red", disabled=True,
                                       on_click=lambda e: delete_models(
-                                          [checkbox.label for checkbox in self.checkboxes if checkbox.value]))
+                                          [checkbox.data for checkbox in self.checkboxes if checkbox.value]))
         self.model_dialog = ft.AlertDialog(
             title = ft.Text("Manage Models"),
             content = model_dialog_content,
@@ -222,6 +260,42 @@ class ChatbotUI:
         self.page.dialog = self.model_dialog
         self.model_dialog.open = True
         self.page.update()
+        model_registry.refresh_in_background()
+
+    def create_model_options(self, models):
+        return [ft.dropdown.Option(model['name']) for model in models] + [ft.dropdown.Option("Add new model")]
+
+    def create_model_checkboxes(self, models):
+        # Size and quantization come with the list endpoint, no extra request per model
+        return [
+            ft.Checkbox(
+                label=f"{model['name']}  ({format_size(model['size'])}"
+                      + (f", {model['quantization']}" if model['quantization'] else "") + ")",
+                value=False, on_change=self.model_checkbox_change, data=model['name'],
+            )
+            for model in models
+        ]
+
+    def models_changed(self, models):
+        # Registry notification, updates the dropdown and an open manage-models dialog in place
+        self.model_options = self.create_model_options(models)
+        self.model_dropdown.options = self.model_options
+        if self.model_checkboxes is not None and self.model_dialog.open:
+            self.checkboxes = self.create_model_checkboxes(models)
+            self.model_checkboxes.controls = self.checkboxes
+        # e.g. the selected model was just downloaded
+        self.prefetch_model_details()
+        self.page.update()
+
+    def handle_disconnect(self, e):
+        self.page.pubsub.unsubscribe_all()
+        model_registry.unsubscribe(self.models_changed)
+        model_residency.unsubscribe(self.model_state_changed)
+        self.chatbot.unsubscribe(self)
+        if self.download_panel is not None:
+            self.download_panel.close()
+        if self.compare_panel is not None:
+            self.compare_panel.close()
 
 
 
@@ -233,21 +307,20 @@ class ChatbotUI:
             delete_button.disabled = not any(checkbox.value for checkbox in self.checkboxes)
             self.page.update()
         def delete_chats(e):
-            utils.delete_chat(e)
+            utils.delete_chat(e, self.chatbot.chat_folder)
 
             # update chat list in alterWindow
-            chat_list = utils.load_chat_files()
-            self.checkboxes = [ft.Checkbox(label=chat_name.replace(".txt", ""), value=False, on_change=change_box) for
-                               chat_name in chat_list]
+            self.checkboxes = [checkbox for checkbox in self.checkboxes if checkbox.label not in e]
             chat_dialog_content.controls = self.checkboxes
             self.chat_dialog.update()
 
-            # update chat list in main
-            self.load_chat_files()
+            # update chat list in main, only the deleted rows are removed
+            for chat_name in e:
+                self.sidebar.chat_removed(chat_name)
 
 
-        chat_list = utils.load_chat_files()
-        self.checkboxes = [ft.Checkbox(label=chat_name.replace(".txt", ""), value=False, on_change= change_box) for chat_name in chat_list]
+        chat_list = utils.load_chat_files(self.chatbot.chat_folder)
+        self.checkboxes = [ft.Checkbox(label=chat_name, value=False, on_change= change_box) for chat_name in chat_list]
         # make scrollable column
         chat_dialog_content = ft.Column(
             self.checkboxes
@@ -269,29 +342,63 @@ class ChatbotUI:
         self.chat_dialog.open = True
         self.page.update()
 
+    def compare_models(self):
+        # Sends the typed prompt to several models side by side, one answer can be taken over into the chat
+        self.compare_panel = ComparePanel(self.page, self.chatbot, prompt=self.user_input.value or "",
+                                          on_adopt=self.answer_adopted, stream_fps=self.stream_fps)
+        self.compare_dialog = ft.AlertDialog(
+            title=ft.Text("Compare Models"),
+            content=self.compare_panel.column,
+            modal=True,
+            actions=[ft.TextButton("Close", on_click=lambda e: self.close_compare_dialog())],
+        )
+        self.page.dialog = self.compare_dialog
+        self.compare_dialog.open = True
+        self.page.update()
+
+    def close_compare_dialog(self):
+        self.compare_panel.close()
+        self.compare_panel = None
+        self.page.close(self.compare_dialog)
+
+    def answer_adopted(self):
+        self.user_input.value = ""
+        self.close_compare_dialog()
+        self.update_prompt()
+
     def toggle_dark_mode(self, e):
         # Toggle theme mode and adjust Markdown styling
         if e.control.value:
             self.page.theme_mode = ft.ThemeMode.DARK
-            self.chat_display.bgcolor = "black"
-            self.chat_display.color = "white"
+            self.chat_container.bgcolor = "black"
         else:
             self.page.theme_mode = ft.ThemeMode.LIGHT
-            self.chat_display.bgcolor = "white"
-            self.chat_display.color = "black"
+            self.chat_container.bgcolor = "white"
         self.page.update()
+    def toggle_retrieval(self, e):
+        # Send only the relevant chunks of the attached documents instead of their full text
+        self.chatbot.use_retrieval = e.control.value
+        self.update_prompt_size()
+
+    def toggle_compaction(self, e):
+        # Replace older turns by a rolling summary once the history doesn't fit the context window anymore
+        self.chatbot.use_compaction = e.control.value
+        self.update_prompt_size()
+
+    def toggle_response_cache(self, e):
+        # Switches to deterministic sampling, answers to repeated prompts are replayed from the disk cache
+        self.chatbot.set_response_cache(e.control.value)
+
     def manage_layout(self):
 
         def toggle_dark_mode(e):
             # Toggle theme mode and adjust Markdown styling
             if e.control.value:
                 self.page.theme_mode = ft.ThemeMode.DARK
-                self.chat_display.bgcolor = "black"
-                self.chat_display.color = "white"
+                self.chat_container.bgcolor = "black"
             else:
                 self.page.theme_mode = ft.ThemeMode.LIGHT
-                self.chat_display.bgcolor = "white"
-                self.chat_display.color = "black"
+                self.chat_container.bgcolor = "white"
             self.page.update()
 
 
@@ -320,10 +427,48 @@ class ChatbotUI:
             self.add_new_model()
         else:
             self.chatbot.model = self.model_dropdown.value
+            # Loads the model in the background, so the first message doesn't wait for it
+            self.idle_dropdown.value = self.idle_option()
+            self.show_model_state(model_residency.preload(self.chatbot.model,
+                                                          self.chatbot.preload_options(self.user_input.value or "")))
+            self.prefetch_model_details()
+            self.update_prompt_size()
+
+    def prefetch_model_details(self):
+        # The prompt size indicator doesn't ask Ollama itself, it's refreshed once the context length is known
+        if model_registry.cached_details(self.chatbot.model) is None:
+            model_registry.prefetch_details(self.chatbot.model).add_done_callback(self.model_details_fetched)
+
+    def model_details_fetched(self, future):
+        if future.exception() is None:
+            self.update_prompt_size()
+
+    def model_state_changed(self, state):
+        # Residency notification, only the selected model is shown
+        if state.name == self.chatbot.model:
+            self.show_model_state(state)
+
+    def show_model_state(self, state, update=True):
+        ring, label = self.model_status.controls
+        ring.visible = state.status == "loading"
+        label.value, label.color = MODEL_STATUS_TEXT[state.status]
+        label.tooltip = f"{state.error}" if state.status == "failed" else None
+        if update:
+            self.page.update()
+
+    def idle_option(self):
+        limit = model_residency.idle_limit(self.chatbot.model)
+        return str(int(limit)) if str(int(limit)) in dict(IDLE_OPTIONS) else None
+
+    def change_idle_limit(self, e):
+        # Applies to the selected model, the others keep their own limit
+        model_residency.set_idle_limit(self.chatbot.model, float(e.control.value))
 
     def add_new_model(self):
         # Define a placeholder for status messages
         self.status_text = ft.Text("")  # This will be updated with download status
+        # Downloads run in the background, the panel shows their progress while the dialog is open
+        self.download_panel = DownloadPanel(self.page)
         # Define the content of the dialog
         dialog_content = ft.Column(
             [
@@ -334,10 +479,12 @@ class ChatbotUI:
                     spans=[ft.TextSpan("models", url="https://ollama.com/library",
                                        style=ft.TextStyle(decoration="underline", color="blue"))]
                 ),
-                self.status_text
+                self.status_text,
+                self.download_panel.column,
             ],
             alignment=ft.MainAxisAlignment.START,
-            spacing=10
+            spacing=10,
+            tight=True,
         )
 
         # Create and open the dialog
@@ -346,12 +493,19 @@ class ChatbotUI:
             content=dialog_content,
             modal=True,
             actions=[
-                ft.TextButton("Close", on_click=lambda e: self.page.close(self.dialog))  # Add a Close button
+                ft.TextButton("Close", on_click=lambda e: self.close_download_dialog())  # Add a Close button
             ]
         )
         self.page.dialog = self.dialog
         self.dialog.open = True
         self.page.update()
+
+    def close_download_dialog(self):
+        # Downloads keep running after the dialog is closed
+        self.download_panel.close()
+        self.download_panel = None
+        self.page.close(self.dialog)
+
     def download_model(self, model_name):
         model_name = model_name.control.value.strip()
 
@@ -360,76 +514,162 @@ class ChatbotUI:
             self.page.update()
             return
 
-        try:
-            # Update status text to show download initiation
-            self.status_text.value = f"Downloading model '{model_name}'... This might take a while."
-            self.page.update()
-            ollama.pull(model_name)
-            # Update status on success
-            self.status_text.value = f"Model '{model_name}' downloaded successfully!"
-        except:
-            # Update status on failure
-            self.status_text.value = f"Error: Could not download model '{model_name}'. Please check the name."
-
-        model_list = [model['name'] for model in ollama.list()['models']]
-        model_list.append("Add new model")
-        self.model_options = [ft.dropdown.Option(model) for model in model_list]
-        self.model_dropdown.options=self.model_options
-        # Refresh dialog content with updated status
+        # Starts the pull in the background, the panel and the dropdown are updated as it progresses
+        self.status_text.value = f"Downloading model '{model_name}'. You can close this dialog, the download continues."
+        download_manager.start(model_name)
         self.page.update()
 
 
     def load_chat_files(self):
-        # Get chat files
-        chat_files = utils.load_chat_files()
+        # Rebuild the sidebar from the first page of the index
+        self.sidebar.refresh()
+        startup_timer.mark("chats_loaded")
+        self.update_prompt_size()
 
-        # Clear existing sidebar entries
-        self.chat_sidebar.controls.clear()
+    def chat_added(self, chat_name):
+        # Moves the chat to the top of the sidebar, or adds it if it's new
+        self.sidebar.chat_added(chat_name)
 
-        if not chat_files:
-            self.chat_sidebar.controls.append(ft.Text("No saved chats found.", color="grey"))
-        else:
-            for file_name in chat_files:
-                # Create a button for each chat file
-                chat_button = ft.TextButton(
-                    file_name.replace(".txt", ""),
-                    on_click=lambda e, f=file_name: self.open_chat(f)  # Pass file_name to the function
-                )
-                self.chat_sidebar.controls.append(chat_button)
+    def chat_renamed(self, old_name, new_name):
+        self.sidebar.chat_renamed(old_name, new_name)
 
+    def chat_reset(self):
+        self.file_chips.controls.clear()
         self.page.update()
 
-    def open_chat(self, file_name):
-        # Clear the current chat content
-        self.chat_content = ""  # Reset chat content string
-        file_path = os.path.join("saved_chats", file_name)
-        # Load the chat history from the file
-        self.chat_content = utils.format_chat_content(file_path)
-        # Update the Markdown display with the entire chat content
+    def history_changed(self):
         self.update_prompt()
-        self.chatbot.load_chat(file_name)
+
+    def open_chat(self, chat_name, message_seq=None):
+        # The chat is read once: the bot keeps it as the model history, the view renders a page of it
+        self.chatbot.load_chat(chat_name)
+        self.chat_view.show(self.chatbot.current_chat, message_seq)
+        self.update_prompt_size()
+
     def update_prompt(self):
-        self.chat_display.value = self.chat_content
+        # Renders the last page of the current history again and drops the controls of the streamed turns
+        self.chat_view.show(self.chatbot.current_chat)
+        self.update_prompt_size()
+
+    def update_prompt_size(self):
+        """
+        Shows the estimated size of the next request with the typed prompt. Turns orange when little room
+        is left for the answer and red when the model's context window can't hold the prompt, so it would
+        be cut before it's sent.
+        """
+        size = self.chatbot.prompt_size(self.user_input.value or "")
+        tokens, max_ctx = size['tokens'], size['max_ctx']
+        self.prompt_size.value = f"~{format_tokens(tokens)} / {format_tokens(max_ctx)} tokens"
+        if tokens > max_ctx:
+            self.prompt_size.color = "red"
+            self.prompt_size.tooltip = ("The prompt doesn't fit the model's context window, its beginning would be cut off. "
+                                        "Remove attachments or turn on document retrieval or compaction.")
+        elif tokens + ANSWER_RESERVE_TOKENS > max_ctx:
+            self.prompt_size.color = "orange"
+            self.prompt_size.tooltip = "Little room is left for the answer in the model's context window"
+        else:
+            self.prompt_size.color = "grey"
+            self.prompt_size.tooltip = f"Sent with a context window of {size['num_ctx']} tokens"
         self.page.update()
+        # A loaded model runs with a fixed window, it's reloaded now rather than when the prompt is sent
+        state = model_residency.state(self.chatbot.model)
+        if state.status == "ready" and not state.active:
+            model_residency.preload(self.chatbot.model, {**self.chatbot.options, 'num_ctx': size['num_ctx']})
+
     async def stream_response(self, prompt):
         # Display user message in chat
-        self.chat_content += f"**User:** {prompt}\n\n"
-        self.update_prompt()
+        user_text = f"**User:** {prompt}\n\n"
+        self.chat_view.add_message(user_text)
 
-        # Stream assistant's response as it comes in
-        self.chat_content+=f"**Assistant:** "
-        async for part in self.chatbot.send_message(prompt):
-            self.chat_content += f"{part}"  # Append each streamed part
-            self.update_prompt()
+        # Stream assistant's response as it comes in, only the control of the answer is updated
+        answer_display = self.chat_view.add_message("")
+        renderer = StreamRenderer(answer_display, prefix="**Assistant:** ", max_fps=self.stream_fps)
 
-        # Add a line break after the full response is displayed
-        self.chat_content += "\n\n"
-        self.update_prompt()
+        def show_queue_position(position):
+            # Shown until the first token replaces it
+            if position and not renderer.parts:
+                answer_display.value = f"*Waiting in queue (position {position})...*"
+                answer_display.update()
+
+        # Set by the engine once the prompt is part of the chat, a Stop before that keeps nothing
+        recorded = False
+
+        def prompt_recorded():
+            nonlocal recorded
+            recorded = True
+
+        try:
+            # Only wait for attachments if they are not ready yet
+            if self.chatbot.pending_files:
+                self.send_button.disabled = True
+                self.send_button.text = "Processing files..."
+                self.page.update()
+                await self.chatbot.wait_for_files()
+                self.send_button.disabled = False
+                self.send_button.text = "Send"
+                self.page.update()
+            async for part in self.chatbot.send_message(prompt, on_queue_position=show_queue_position,
+                                                        on_recorded=prompt_recorded):
+                renderer.append(part)
+        except asyncio.CancelledError:
+            if not recorded:
+                # Stopped before the prompt was sent, e.g. while the attachments were processed
+                answer_display.value = "*Stopped, nothing was sent.*"
+                self.user_input.value = prompt
+                self.page.update()
+                return
+            # Stopped by the user, the partial answer stays in the chat
+            renderer.append(" *[stopped]*")
+        except QueueFull as e:
+            # Nothing was sent, the prompt isn't part of the chat
+            answer_display.value = f"*{e}*"
+            self.user_input.value = prompt
+            self.page.update()
+            return
+        except Exception as e:
+            # e.g. Ollama isn't reachable, the prompt isn't part of the chat either
+            renderer.cancel()
+            answer_display.value = f"*Error: {e}*"
+            self.user_input.value = prompt
+            self.page.update()
+            return
+
+        # Always show the last tokens and add a line break after the full response
+        answer = renderer.finish()
+        # Footer with TTFT, tokens/s, prompt tokens and load time of this answer
+        footer = utils.metrics_footer(self.chatbot.last_metrics)
+        if footer:
+            answer_display.value = f"{renderer.prefix}{answer}\n\n{footer}"
+            answer_display.update()
+        self.update_prompt_size()
+
+    async def run_generation(self, prompt):
+        # Runs as a task on the app's event loop, so the handler thread isn't blocked and it can be cancelled
+        self.generation_task = asyncio.current_task()
+        self.send_button.visible = False
+        self.stop_button.visible = True
+        self.page.update()
+        try:
+            await self.stream_response(prompt)
+        finally:
+            self.generation_task = None
+            self.generating = False
+            self.send_button.disabled = False
+            self.send_button.text = "Send"
+            self.send_button.visible = True
+            self.stop_button.visible = False
+            self.page.update()
+
+    async def stop_generation(self, e):
+        if self.generation_task:
+            self.generation_task.cancel()
 
     def handle_send_message(self):
-        # Get user input, start the streaming coroutine
+        # Get user input, start the streaming task
         user_message = self.user_input.value
-        if user_message:
+        if user_message and not self.generating:
+            # Set before the task starts, so a quick second Enter doesn't send the prompt twice
+            self.generating = True
             self.user_input.value = ""  # Clear the input field
-            asyncio.run(self.stream_response(user_message))  # Start the async streaming
+            self.page.run_task(self.run_generation, user_message)  # Start the async streaming
 
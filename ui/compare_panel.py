@@ -0,0 +1,128 @@
+import asyncio
+
+import flet as ft
+
+from bot.compare import compare
+from bot.model_registry import model_registry
+from ui.stream_renderer import StreamRenderer
+
+
+def format_comparison(metrics):
+    # e.g. "TTFT 0.42 s · 38.1 tok/s · total 3.10 s"
+    parts = []
+    if metrics.get('ttft_ms') is not None:
+        parts.append(f"TTFT {metrics['ttft_ms'] / 1000:.2f} s")
+    if metrics.get('tokens_per_s'):
+        parts.append(f"{metrics['tokens_per_s']:.1f} tok/s")
+    parts.append(f"total {metrics['total_ms'] / 1000:.2f} s")
+    return " · ".join(parts)
+
+
+class ComparePanel:
+    """
+    Compare mode: one prompt, with the chat's history and attached files, is sent to the selected models
+    and every answer streams into its own column, with TTFT, tokens/s and total time below it.
+    "Use this answer" adds the prompt and that answer to the chat and calls on_adopt(). Call close() when
+    the panel is no longer shown, a running comparison is stopped.
+    """
+
+    def __init__(self, page: ft.Page, chatbot, prompt="", on_adopt=None, stream_fps=25):
+        self.page = page
+        self.chatbot = chatbot
+        self.on_adopt = on_adopt
+        self.stream_fps = stream_fps
+        self.task = None
+        self.checkboxes = [ft.Checkbox(label=name, value=name == chatbot.model, data=name)
+                           for name in model_registry.names()]
+        self.prompt_field = ft.TextField(label="Prompt", value=prompt, multiline=True, min_lines=1, max_lines=4)
+        self.compare_button = ft.ElevatedButton("Compare", icon="compare_arrows", on_click=self.start)
+        self.status_text = ft.Text("", size=12, color="grey")
+        self.results = ft.Row(spacing=10, scroll="auto", vertical_alignment=ft.CrossAxisAlignment.START)
+        self.column = ft.Column(
+            [
+                ft.Row(self.checkboxes, wrap=True),
+                self.prompt_field,
+                ft.Row([self.compare_button, self.status_text]),
+                self.results,
+            ],
+            spacing=10,
+            width=900,
+            tight=True,
+        )
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def create_column(self, model):
+        column = ft.Column(
+            [
+                ft.Text(model, weight=ft.FontWeight.BOLD),
+                ft.Text("Waiting...", size=12, color="grey"),
+                ft.Markdown("", selectable=True, extension_set=ft.MarkdownExtensionSet.GITHUB_WEB),
+                ft.TextButton("Use this answer", disabled=True),
+            ],
+            spacing=6,
+            scroll="auto",
+        )
+        return ft.Container(column, width=280, height=420, padding=10, border=ft.border.all(1, "lightgrey"),
+                            border_radius=10)
+
+    def start(self, e):
+        models = [checkbox.data for checkbox in self.checkboxes if checkbox.value]
+        prompt = (self.prompt_field.value or "").strip()
+        if self.task is not None:
+            return
+        if not models or not prompt:
+            self.status_text.value = "Select at least one model and enter a prompt."
+            self.page.update()
+            return
+        self.page.run_task(self.run, prompt, models)
+
+    async def run(self, prompt, models):
+        # Runs as a task on the app's event loop, the columns are updated as the answers stream in
+        self.task = asyncio.current_task()
+        self.compare_button.disabled = True
+        self.status_text.value = ""
+        containers = {model: self.create_column(model) for model in models}
+        self.results.controls = list(containers.values())
+        self.page.update()
+        renderers = {model: StreamRenderer(containers[model].content.controls[2], max_fps=self.stream_fps)
+                     for model in models}
+
+        def on_part(model, text):
+            renderers[model].append(text)
+
+        def on_status(model, status):
+            detail = containers[model].content.controls[1]
+            if status == "waiting":
+                detail.value = "Waiting for a free slot..."
+            elif status == "running":
+                detail.value = "Generating..."
+            detail.update()
+
+        try:
+            results = await compare(self.chatbot, prompt, models, on_part, on_status)
+        except asyncio.CancelledError:
+            for renderer in renderers.values():
+                renderer.cancel()
+            return
+        finally:
+            self.task = None
+            self.compare_button.disabled = False
+        for model, result in results.items():
+            renderers[model].finish()
+            detail, button = containers[model].content.controls[1], containers[model].content.controls[3]
+            if result['error']:
+                detail.value = f"Error: {result['error']}"
+                detail.color = "red"
+            else:
+                detail.value = format_comparison(result['metrics'])
+                button.disabled = not result['content']
+                button.on_click = lambda e, result=result: self.adopt(prompt, result)
+        self.page.update()
+
+    def adopt(self, prompt, result):
+        self.chatbot.adopt_answer(prompt, result['content'], result['metrics'])
+        if self.on_adopt:
+            self.on_adopt()
@@ -0,0 +1,72 @@
+import flet as ft
+
+from bot.downloads import download_manager
+from bot.model_registry import format_size
+
+
+class DownloadPanel:
+    """
+    Live list of the model downloads with a progress bar, bytes, throughput and a Cancel/Resume button
+    per model. Progress arrives from the client loop through the download manager's listeners, only the
+    row of the changed download is updated. Call close() when the panel is no longer shown; the
+    downloads themselves keep running.
+    """
+
+    def __init__(self, page: ft.Page, names=None):
+        self.page = page
+        # Only the given models are shown, all downloads if None
+        self.names = names
+        self.rows = {}
+        self.column = ft.Column(spacing=12, scroll="auto")
+        for download in download_manager.downloads.values():
+            self.download_changed(download, update=False)
+        download_manager.subscribe(self.download_changed)
+
+    def close(self):
+        download_manager.unsubscribe(self.download_changed)
+
+    def create_row(self, download):
+        row = ft.Column(
+            [
+                ft.Row([ft.Text(download.name, weight=ft.FontWeight.BOLD, expand=True), ft.TextButton()]),
+                ft.ProgressBar(width=400),
+                ft.Text(size=12, color="grey"),
+            ],
+            spacing=4,
+        )
+        self.rows[download.name] = row
+        self.column.controls.append(row)
+        return row
+
+    def download_changed(self, download, update=True):
+        if self.names is not None and download.name not in self.names:
+            return
+        row = self.rows.get(download.name) or self.create_row(download)
+        button = row.controls[0].controls[1]
+        progress_bar, detail = row.controls[1], row.controls[2]
+
+        if download.status == "done":
+            progress_bar.value = 1
+        elif download.total:
+            progress_bar.value = download.percent / 100
+        else:
+            # Unknown size while the manifest is fetched
+            progress_bar.value = None if download.active else 0
+
+        detail.value = download.status_text
+        if download.status == "downloading" and download.total:
+            detail.value = (f"{download.status_text} - {format_size(download.completed)} of "
+                            f"{format_size(download.total)} ({download.percent:.0f}%), "
+                            f"{format_size(download.throughput)}/s")
+
+        if download.active:
+            button.text, button.visible = "Cancel", True
+            button.on_click = lambda e, name=download.name: download_manager.cancel(name)
+        elif download.status in ("failed", "cancelled"):
+            button.text, button.visible = "Resume", True
+            button.on_click = lambda e, name=download.name: download_manager.resume(name)
+        else:
+            button.visible = False
+
+        if update:
+            self.page.update()
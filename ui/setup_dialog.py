@@ -0,0 +1,88 @@
+import sys
+import asyncio
+
+import flet as ft
+import httpx
+
+from bot.model_registry import model_registry
+from bot.downloads import download_manager
+from bot.residency import model_residency
+from utils.startup import startup_timer
+from ui.download_panel import DownloadPanel
+
+
+async def setup(page: ft.Page, model_name="llama3.2:latest", options=None):
+    """
+    Checks for Ollama and the default model. Runs in the background once the window is drawn, the dialog
+    only opens if Ollama isn't reachable or the model is missing. An installed model is preloaded with
+    options, those of the first request.
+    """
+    # Define alert dialog for setup process
+    status_text = ft.Text(value="Checking for Ollama installation...")
+    cancel_button = ft.TextButton("Cancel", on_click=lambda e: exit_program(page))
+
+    setup_dialog = ft.AlertDialog(
+        title=ft.Text("Setup in Progress"),
+        content=status_text,
+        actions=[cancel_button],
+        modal=True
+    )
+
+    def open_setup_dialog():
+        if not setup_dialog.open:
+            page.dialog = setup_dialog
+            setup_dialog.open = True
+
+    # Loop to check for ollama installation
+    while True:
+        #subprocess.run(["powershell.exe", "-Command", "ollama --version"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            # Shares the request with the model list refresh started by the UI
+            await model_registry.refresh()
+            status_text.value = "Ollama is installed."
+            page.update()
+            break  # Exit the loop if ollama is installed
+        except httpx.ConnectError as e:
+            # Show installation instructions if Ollama is not installed
+            status_text.value = "Ollama is not installed or not running. Please install it here:"
+            link = ft.Text("Ollama ",
+                           spans=[ft.TextSpan("Installation", url="https://ollama.com/download",
+                                              style=ft.TextStyle(decoration="underline", color="blue")), ])
+            setup_dialog.content = ft.Column([status_text, link])
+            open_setup_dialog()
+            page.update()
+        finally:
+            startup_timer.mark("models_loaded")
+
+        # Wait for 4 seconds before rechecking
+        await asyncio.sleep(4)
+
+    # Step 2: Check if the default model is available
+    available_models = model_registry.names()
+    if model_name not in available_models:
+        # The pull runs in the background, installed models can be used while it downloads
+        status_text.value = f"Ollama is installed, but {model_name} is missing. Downloading now... You can close this dialog, the download continues."
+        download_manager.start(model_name)
+        download_panel = DownloadPanel(page, names=[model_name])
+
+        def close_setup(e):
+            download_panel.close()
+            page.close(setup_dialog)
+
+        setup_dialog.content = ft.Column([status_text, download_panel.column], tight=True)
+        setup_dialog.actions = [ft.TextButton("Close", on_click=close_setup)]
+        open_setup_dialog()
+        page.update()
+        return
+
+    # Loads the model while the user types the first message
+    model_residency.preload(model_name, options)
+    if setup_dialog.open:
+        page.close(setup_dialog)
+
+
+def exit_program(page):
+    # Close the dialog and exit the program
+    page.dialog.open = False
+    page.update()
+    sys.exit()
@@ -0,0 +1,60 @@
+import time
+import asyncio
+
+
+class StreamRenderer:
+    """
+    Renders a streamed answer into a single Markdown control at a limited frame rate.
+    Tokens are collected in a buffer and the control is updated at most max_fps times per second,
+    only the control of the message that is currently changing is sent to the client. Tokens that arrive
+    within the interval are shown when it ends, even if no other token follows (e.g. during a pause of the
+    model). finish() always flushes the last tokens, cancel() drops a pending update.
+    """
+
+    def __init__(self, control, prefix="", max_fps=25):
+        self.control = control
+        self.prefix = prefix
+        self.interval = 1 / max_fps if max_fps else 0
+        self.parts = []
+        self._dirty = False
+        self._last_flush = 0.0
+        # Pending update at the end of the current interval
+        self._timer = None
+
+    @property
+    def text(self):
+        return "".join(self.parts)
+
+    def append(self, token):
+        self.parts.append(token)
+        self._dirty = True
+        now = time.monotonic()
+        remaining = self.interval - (now - self._last_flush)
+        if remaining <= 0:
+            self.flush(now)
+        elif self._timer is None:
+            try:
+                self._timer = asyncio.get_running_loop().call_later(remaining, self.flush)
+            except RuntimeError:
+                # Not called from an event loop, the next token or finish() shows the text
+                pass
+
+    def cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def flush(self, now=None):
+        self.cancel()
+        if not self._dirty:
+            return
+        # Join once per frame instead of once per token
+        self.parts = [self.text]
+        self.control.value = self.prefix + self.parts[0]
+        self.control.update()
+        self._dirty = False
+        self._last_flush = now if now is not None else time.monotonic()
+
+    def finish(self):
+        self.flush()
+        return self.text
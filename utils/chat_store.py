@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import pickle
+import shutil
+import sqlite3
+import threading
+
+DB_NAME = "chats.db"
+PREVIEW_LENGTH = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0,
+    preview TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS chats_updated ON chats (updated DESC);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created REAL NOT NULL,
+    meta TEXT,
+    UNIQUE (chat_id, seq)
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    chat_id INTEGER NOT NULL REFERENCES chats(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT,
+    PRIMARY KEY (chat_id, path)
+);
+CREATE TABLE IF NOT EXISTS summaries (
+    chat_id INTEGER PRIMARY KEY REFERENCES chats(id) ON DELETE CASCADE,
+    content TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Full-text index over all messages, kept in sync by triggers in the same transaction as the write
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE messages_fts USING fts5(
+    content, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+END;
+CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+END;
+INSERT INTO messages_fts (messages_fts) VALUES ('rebuild');
+"""
+
+
+class ChatStore:
+    """
+    SQLite-backed store for all chats of one folder. A turn is written in one transaction, messages are
+    addressed by (chat, seq), so any range of a chat can be read without parsing the rest of it,
+    and the attachments and the rolling summary of a chat are stored next to its messages.
+    """
+
+    def __init__(self, chat_folder="saved_chats"):
+        self.chat_folder = chat_folder
+        os.makedirs(chat_folder, exist_ok=True)
+        self.db_path = os.path.join(chat_folder, DB_NAME)
+        # One connection shared by the UI, ingestion and title threads, serialized by the lock
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._upgrade_schema()
+        self._db.executescript(SCHEMA)
+        self._create_fts()
+
+    def _upgrade_schema(self):
+        # Databases created before the sidebar columns existed get them added and backfilled
+        columns = [row["name"] for row in self._db.execute("PRAGMA table_info(chats)")]
+        if columns and "message_count" not in columns:
+            with self._db:
+                self._db.execute("ALTER TABLE chats ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0")
+                self._db.execute("ALTER TABLE chats ADD COLUMN preview TEXT NOT NULL DEFAULT ''")
+                self._db.execute(
+                    "UPDATE chats SET "
+                    "message_count = (SELECT COUNT(*) FROM messages WHERE chat_id = chats.id), "
+                    "preview = COALESCE((SELECT substr(content, 1, ?) FROM messages "
+                    "WHERE chat_id = chats.id AND role = 'user' ORDER BY seq LIMIT 1), '')",
+                    (PREVIEW_LENGTH,))
+
+    def _create_fts(self):
+        # Created once, existing messages are indexed by the 'rebuild' command
+        exists = self._db.execute("SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'").fetchone()
+        if not exists:
+            with self._db:
+                self._db.executescript(FTS_SCHEMA)
+
+    def _chat_id(self, name):
+        row = self._db.execute("SELECT id FROM chats WHERE name = ?", (name,)).fetchone()
+        return row["id"] if row else None
+
+    def chat_exists(self, name):
+        with self._lock:
+            return self._chat_id(name) is not None
+
+    def create_chat(self, name, created=None):
+        created = created or time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR IGNORE INTO chats (name, created, updated) VALUES (?, ?, ?)",
+                             (name, created, created))
+            return self._chat_id(name)
+
+    def append_messages(self, name, messages, updated=None):
+        """
+        Appends the messages of one turn in a single transaction. The chat is created if needed.
+        """
+        updated = updated or time.time()
+        with self._lock, self._db:
+            chat_id = self._chat_id(name)
+            if chat_id is None:
+                self._db.execute("INSERT INTO chats (name, created, updated) VALUES (?, ?, ?)", (name, updated, updated))
+                chat_id = self._chat_id(name)
+            next_seq = self._db.execute("SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE chat_id = ?",
+                                        (chat_id,)).fetchone()[0]
+            self._db.executemany(
+                "INSERT INTO messages (chat_id, seq, role, content, created, meta) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (chat_id, next_seq + i, message["role"], message["content"], updated,
+                     json.dumps(message["meta"]) if message.get("meta") else None)
+                    for i, message in enumerate(messages)
+                ],
+            )
+            # The sidebar columns are kept up to date with every turn
+            preview = next((m["content"][:PREVIEW_LENGTH] for m in messages if m["role"] == "user"), "")
+            self._db.execute(
+                "UPDATE chats SET updated = ?, message_count = message_count + ?, "
+                "preview = CASE WHEN preview = '' THEN ? ELSE preview END WHERE id = ?",
+                (updated, len(messages), preview, chat_id))
+
+    def message_count(self, name):
+        with self._lock:
+            row = self._db.execute("SELECT message_count FROM chats WHERE name = ?", (name,)).fetchone()
+        return row["message_count"] if row else 0
+
+    def load_messages(self, name, start=0, end=None):
+        """
+        Returns the messages [start, end) of a chat as {'role', 'content'} dicts, plus 'meta' if stored.
+        """
+        end = end if end is not None else 2 ** 62
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT role, content, meta FROM messages JOIN chats ON chats.id = messages.chat_id "
+                "WHERE chats.name = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                (name, start, end)).fetchall()
+        messages = []
+        for row in rows:
+            message = {"role": row["role"], "content": row["content"]}
+            if row["meta"]:
+                message["meta"] = json.loads(row["meta"])
+            messages.append(message)
+        return messages
+
+    def list_chats(self):
+        # Most recently updated first
+        with self._lock:
+            return [row["name"] for row in self._db.execute("SELECT name FROM chats ORDER BY updated DESC")]
+
+    def chat_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+
+    def list_chat_entries(self, offset=0, limit=None):
+        """
+        Sidebar rows {"name", "updated", "message_count", "preview"}, most recently updated first.
+        Served from the chats table and its index on updated, no message is read.
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name, updated, message_count, preview FROM chats ORDER BY updated DESC LIMIT ? OFFSET ?",
+                (-1 if limit is None else limit, offset)).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_chat_entry(self, name):
+        with self._lock:
+            row = self._db.execute("SELECT name, updated, message_count, preview FROM chats WHERE name = ?",
+                                   (name,)).fetchone()
+        return dict(row) if row else None
+
+    def search(self, query, limit=50):
+        """
+        Ranked full-text search over all messages. Returns {"name", "seq", "role", "snippet"} dicts, best
+        match first; matched terms in the snippet are wrapped in ** for Markdown.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT chats.name AS name, messages.seq AS seq, messages.role AS role, "
+                "snippet(messages_fts, 0, '**', '**', '...', 16) AS snippet "
+                "FROM messages_fts "
+                "JOIN messages ON messages.id = messages_fts.rowid "
+                "JOIN chats ON chats.id = messages.chat_id "
+                "WHERE messages_fts MATCH ? ORDER BY bm25(messages_fts) LIMIT ?",
+                (match, limit)).fetchall()
+        return [dict(row) for row in rows]
+
+    def rename_chat(self, old_name, new_name):
+        with self._lock, self._db:
+            self._db.execute("UPDATE chats SET name = ? WHERE name = ?", (new_name, old_name))
+
+    def delete_chat(self, name):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM chats WHERE name = ?", (name,))
+
+    def set_attachments(self, name, attachments):
+        """
+        attachments: list of {"path", "hash"} entries, replacing the stored ones.
+        """
+        with self._lock, self._db:
+            chat_id = self._chat_id(name)
+            if chat_id is None:
+                return
+            self._db.execute("DELETE FROM attachments WHERE chat_id = ?", (chat_id,))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO attachments (chat_id, position, path, hash) VALUES (?, ?, ?, ?)",
+                [(chat_id, i, entry["path"], entry["hash"]) for i, entry in enumerate(attachments)],
+            )
+
+    def get_attachments(self, name):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path, hash FROM attachments JOIN chats ON chats.id = attachments.chat_id "
+                "WHERE chats.name = ? ORDER BY position", (name,)).fetchall()
+        return [{"path": row["path"], "hash": row["hash"]} for row in rows]
+
+    def set_summary(self, name, content, message_count):
+        """
+        Rolling summary of the first message_count messages of a chat, used for compaction.
+        """
+        with self._lock, self._db:
+            chat_id = self._chat_id(name)
+            if chat_id is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO summaries (chat_id, content, message_count, updated) VALUES (?, ?, ?, ?)",
+                (chat_id, content, message_count, time.time()))
+
+    def get_summary(self, name):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT summaries.content, summaries.message_count FROM summaries JOIN chats ON chats.id = summaries.chat_id "
+                "WHERE chats.name = ?", (name,)).fetchone()
+        return {"content": row["content"], "message_count": row["message_count"]} if row else None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def fts_query(query):
+    """
+    Turns user input into an FTS5 query: every word has to match, the last one as a prefix
+    so results show up while typing. Quoting keeps FTS5 syntax characters from being interpreted.
+    """
+    terms = [term.replace('"', '""') for term in query.split()]
+    if not terms:
+        return ""
+    return " ".join(f'"{term}"' for term in terms[:-1]) + (" " if len(terms) > 1 else "") + f'"{terms[-1]}"*'
+
+
+def parse_txt_chat(file_path):
+    """
+    Parses an old line-prefixed .txt chat. Lines without a "user: " / "assistant: " prefix belong to the
+    previous message, so multi-line replies are kept in one piece.
+    """
+    messages = []
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            line = line.rstrip("\n")
+            if line.startswith("user: "):
+                messages.append({"role": "user", "content": line[len("user: "):]})
+            elif line.startswith("assistant: "):
+                messages.append({"role": "assistant", "content": line[len("assistant: "):]})
+            elif messages:
+                messages[-1]["content"] += "\n" + line
+    for message in messages:
+        message["content"] = message["content"].strip()
+    return messages
+
+
+def migrate_txt_chats(store):
+    """
+    One-shot import of the old saved_chats/*.txt files (and their .files.json/.pkl attachment lists) into
+    the store. Imported files are moved to saved_chats/migrated, so the migration only runs once.
+    """
+    chat_folder = store.chat_folder
+    txt_files = [f for f in os.listdir(chat_folder) if f.endswith(".txt")]
+    if not txt_files:
+        return 0
+
+    migrated_folder = os.path.join(chat_folder, "migrated")
+    os.makedirs(migrated_folder, exist_ok=True)
+    for file_name in txt_files:
+        name = file_name[:-len(".txt")]
+        file_path = os.path.join(chat_folder, file_name)
+        if not store.chat_exists(name):
+            store.append_messages(name, parse_txt_chat(file_path), updated=os.path.getmtime(file_path))
+
+        attachments = []
+        json_path = os.path.join(chat_folder, name + ".files.json")
+        pkl_path = os.path.join(chat_folder, name + ".pkl")
+        if os.path.exists(json_path):
+            with open(json_path, "r", encoding="utf-8") as f:
+                attachments = json.load(f)
+        elif os.path.exists(pkl_path):
+            with open(pkl_path, "rb") as f:
+                attachments = [{"path": path, "hash": None} for path in pickle.load(f)]
+        if attachments:
+            store.set_attachments(name, attachments)
+
+        for path in (file_path, json_path, pkl_path):
+            if os.path.exists(path):
+                shutil.move(path, os.path.join(migrated_folder, os.path.basename(path)))
+    return len(txt_files)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(chat_folder="saved_chats"):
+    # One store per folder, old .txt chats are migrated when it's opened
+    with _stores_lock:
+        if chat_folder not in _stores:
+            store = ChatStore(chat_folder)
+            migrate_txt_chats(store)
+            _stores[chat_folder] = store
+        return _stores[chat_folder]
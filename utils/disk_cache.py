@@ -0,0 +1,120 @@
+import os
+import json
+import time
+import atexit
+import threading
+
+# Hits only change the LRU order, it's written at most this often (and with every write and at exit)
+TOUCH_SAVE_INTERVAL = 60.0
+
+
+class DiskCache:
+    """
+    Size-bounded on-disk store of text entries with a JSON index. Entries are evicted least-recently-used
+    once the store grows beyond max_bytes. Subclasses add what they keep per entry: _entry_files() lists
+    the files of an entry, _is_pinned() protects entries that are still in use from eviction.
+    A hit only updates the LRU order in memory, the index is written with the next put, after
+    TOUCH_SAVE_INTERVAL seconds or by flush() at exit.
+    """
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        self._lock = threading.Lock()
+        self._index = None
+        # The index has changes that aren't on disk yet, and when it was last written
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        atexit.register(self.flush)
+
+    def _load_index(self):
+        if self._index is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            try:
+                with open(self.index_path, "r", encoding="utf-8") as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+            self._index.setdefault("entries", {})
+        return self._index
+
+    def _save_index(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def _touch(self, key):
+        # Marks an entry as used, the index is written later unless it wasn't for a while
+        self._index["entries"][key]["last_used"] = time.time()
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= TOUCH_SAVE_INTERVAL:
+            self._save_index()
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                try:
+                    self._save_index()
+                except OSError:
+                    # e.g. the cache folder was deleted, only the LRU order is lost
+                    pass
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + ".txt")
+
+    def _entry_files(self, key):
+        return [self._entry_path(key)]
+
+    def _is_pinned(self, key):
+        return False
+
+    def get(self, key):
+        with self._lock:
+            index = self._load_index()
+            if key not in index["entries"]:
+                return None
+            try:
+                with open(self._entry_path(key), "r", encoding="utf-8") as f:
+                    text = f.read()
+            except OSError:
+                del index["entries"][key]
+                self._save_index()
+                return None
+            self._touch(key)
+            return text
+
+    def put(self, key, text):
+        data = text.encode("utf-8")
+        with self._lock:
+            index = self._load_index()
+            tmp_path = self._entry_path(key) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._entry_path(key))
+            index["entries"][key] = {"size": len(data), "last_used": time.time()}
+            self._evict(keep=key)
+            self._save_index()
+
+    def _evict(self, keep=None):
+        # keep: the entry that is being written, it's never evicted by its own write
+        entries = self._index["entries"]
+        total = sum(entry["size"] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep or self._is_pinned(key):
+                continue
+            total -= entries.pop(key)["size"]
+            for path in self._entry_files(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._load_index()["entries"]
@@ -0,0 +1,195 @@
+import os
+import re
+import math
+import threading
+from collections import deque
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from utils.pdf_cache import extraction_cache
+
+# Bump when the extraction output changes, so old cache entries aren't used anymore
+EXTRACTOR_VERSION = 2
+
+MAX_PAGES_PER_TASK = 16
+# Plain-text and source files are stored in pages of this many lines
+LINES_PER_PAGE = 200
+# Larger attachments are refused, their text wouldn't fit any context window anyway
+MAX_FILE_BYTES = 256 * 1024 * 1024
+
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.rst', '.csv', '.tsv', '.log', '.json', '.jsonl', '.yaml', '.yml', '.toml', '.ini', '.cfg',
+    '.xml', '.html', '.css', '.tex', '.sql', '.sh', '.bat', '.ps1',
+    '.py', '.js', '.ts', '.jsx', '.tsx', '.java', '.kt', '.scala', '.c', '.h', '.cpp', '.hpp', '.cs', '.go',
+    '.rs', '.rb', '.php', '.swift', '.lua', '.pl', '.r', '.m',
+}
+SUPPORTED_EXTENSIONS = {'.pdf'} | TEXT_EXTENSIONS
+
+# Runs of newlines or spaces, collapsed to one in a single pass
+WHITESPACE_RUNS = re.compile(r'(\n)\n+|( ) +')
+
+
+def file_type(file_path):
+    return Path(file_path).suffix.lower()
+
+
+def is_supported(file_path):
+    return file_type(file_path) in SUPPORTED_EXTENSIONS
+
+
+def open_pdf(pdf_path):
+    # PyMuPDF is imported with the first attached PDF, starting the app doesn't need it
+    import fitz
+    return fitz.open(pdf_path)
+
+
+def extract_pages(pdf_path, start=0, end=None):
+    """
+    Extracts the raw text of the pages [start, end) of a PDF as a list of strings.
+    Runs in the worker processes of the ingestion pool, so it only depends on PyMuPDF.
+    """
+    with open_pdf(pdf_path) as pdf:
+        end = pdf.page_count if end is None else min(end, pdf.page_count)
+        return [pdf[page_num].get_text("text") for page_num in range(start, end)]
+
+
+def page_count(pdf_path):
+    with open_pdf(pdf_path) as pdf:
+        return pdf.page_count
+
+
+def normalize_text(text):
+    return WHITESPACE_RUNS.sub(r'\1\2', text)
+
+
+def normalize_pages(pages):
+    """
+    Normalizes raw page texts one at a time. A run of whitespace across a page break is collapsed too,
+    so the pages joined are the same as the normalized text of the whole document.
+    """
+    last_char = ""
+    for page in pages:
+        page = normalize_text(page)
+        if page and page[0] == last_char and last_char in "\n ":
+            page = page[1:]
+        if page:
+            last_char = page[-1]
+        yield page
+
+
+def iter_pdf_pages(pdf_path):
+    # Raw page texts of a PDF in this process, MAX_PAGES_PER_TASK pages at a time
+    for start in range(0, page_count(pdf_path), MAX_PAGES_PER_TASK):
+        yield from extract_pages(pdf_path, start, start + MAX_PAGES_PER_TASK)
+
+
+def iter_text_pages(file_path):
+    """
+    Pages of LINES_PER_PAGE lines of a plain-text or source file. Whitespace is kept as is, indentation
+    matters in code. Bytes that aren't UTF-8 are replaced instead of failing the attachment.
+    """
+    with open(file_path, "r", encoding="utf-8", errors="replace") as file:
+        lines = []
+        for line in file:
+            lines.append(line)
+            if len(lines) == LINES_PER_PAGE:
+                yield "".join(lines)
+                lines = []
+        if lines:
+            yield "".join(lines)
+
+
+def iter_pages(file_path):
+    # Normalized pages of any supported attachment, extracted in the calling thread
+    if file_type(file_path) == '.pdf':
+        return normalize_pages(iter_pdf_pages(file_path))
+    return iter_text_pages(file_path)
+
+
+def check_attachment(file_path):
+    if not is_supported(file_path):
+        raise ValueError(f"Unsupported file type: {Path(file_path).name}")
+    if os.path.getsize(file_path) > MAX_FILE_BYTES:
+        raise ValueError(f"{Path(file_path).name} is larger than {MAX_FILE_BYTES // (1024 * 1024)} MB")
+
+
+class IngestionPipeline:
+    """
+    Extracts attachments off the UI thread into the extraction cache. PDF page ranges are extracted in a
+    process pool, in parallel across files and across ranges of one large file. Every file is coordinated
+    by a thread that checks the cache, keeps a bounded window of ranges in flight and writes the pages to
+    disk in order as they come, so a document is never held in memory as a whole.
+    Plain-text and source files are read and written in pages by the coordinating thread.
+    """
+
+    def __init__(self, max_workers=None, max_files=4):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._process_pool = None
+        # The pool is created lazily by the coordinating threads, only one of them may start it
+        self._pool_lock = threading.Lock()
+        self._file_pool = ThreadPoolExecutor(max_workers=max_files, thread_name_prefix="ingestion")
+
+    @property
+    def process_pool(self):
+        # The pool is only started on the first document that isn't in the cache
+        with self._pool_lock:
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._process_pool
+
+    def submit(self, file_path, known_hash=None, on_progress=None):
+        """
+        Starts the ingestion of one file. Returns a concurrent.futures.Future resolving to (hash, Document).
+        on_progress(file_path, done_pages, total_pages) is called from the coordinating thread.
+        """
+        return self._file_pool.submit(self._ingest, file_path, known_hash, on_progress)
+
+    def _ingest(self, file_path, known_hash, on_progress):
+        if not known_hash or os.path.exists(file_path):
+            check_attachment(file_path)
+
+        def extract(path):
+            if file_type(path) == '.pdf':
+                return normalize_pages(self.extract(path, on_progress))
+            return iter_text_pages(path)
+
+        file_hash, document = extraction_cache.get_or_extract(file_path, extract, EXTRACTOR_VERSION, known_hash)
+        if on_progress:
+            on_progress(file_path, 1, 1)
+        return file_hash, document
+
+    def extract(self, pdf_path, on_progress=None):
+        """
+        Yields the raw page texts of a PDF in order. At most two ranges per worker are in flight, a range
+        that completes early waits in memory until the ranges before it are written.
+        """
+        total = page_count(pdf_path)
+        # Small documents are split into single pages, large ones into ranges of up to MAX_PAGES_PER_TASK
+        pages_per_task = max(1, min(MAX_PAGES_PER_TASK, math.ceil(total / (self.max_workers * 2))))
+        starts = iter(range(0, total, pages_per_task))
+        in_flight = deque()
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                in_flight.append(self.process_pool.submit(extract_pages, pdf_path, start, start + pages_per_task))
+
+        for _ in range(self.max_workers * 2):
+            submit_next()
+        done = 0
+        while in_flight:
+            page_texts = in_flight.popleft().result()
+            submit_next()
+            yield from page_texts
+            done += len(page_texts)
+            if on_progress:
+                on_progress(pdf_path, done, total)
+
+    def shutdown(self):
+        self._file_pool.shutdown(wait=False, cancel_futures=True)
+        with self._pool_lock:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+
+ingestion_pipeline = IngestionPipeline()
@@ -0,0 +1,178 @@
+import os
+import json
+import mmap
+import time
+import weakref
+import hashlib
+import threading
+
+from utils.disk_cache import DiskCache
+
+CACHE_DIR = os.path.join("cache", "extracted_text")
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+# Number of file paths whose hash is remembered, the least recently hashed are dropped
+MAX_PATH_MEMO = 1024
+
+
+def file_hash(file_path, chunk_size=1024 * 1024):
+    """
+    sha256 of the file content. Used as the content address of an attachment, so the same document
+    attached in several chats (or under different paths) shares one cache entry.
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class Document:
+    """
+    Extracted text of an attachment as stored in the extraction cache: UTF-8 text plus the byte offset
+    of every page. The file is memory-mapped when text is read, so only the requested pages are decoded
+    and nothing is held in memory between reads.
+    """
+
+    def __init__(self, path, offsets):
+        self.path = path
+        # offsets[i] is where page i starts, offsets[-1] is the size of the text
+        self.offsets = offsets
+
+    @property
+    def page_count(self):
+        return len(self.offsets) - 1
+
+    @property
+    def size(self):
+        return self.offsets[-1]
+
+    def pages(self, start=0, end=None):
+        # Text of the pages [start, end)
+        end = self.page_count if end is None else min(end, self.page_count)
+        if start >= end or self.offsets[start] == self.offsets[end]:
+            return ""
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return data[self.offsets[start]:self.offsets[end]].decode("utf-8")
+
+    def text(self):
+        return self.pages()
+
+    def iter_pages(self):
+        for page_num in range(self.page_count):
+            yield self.pages(page_num, page_num + 1)
+
+
+class ExtractionCache(DiskCache):
+    """
+    On-disk cache for extracted document text, keyed by content hash and extractor version.
+    Documents are written page by page and read back as memory-mapped Documents.
+    Entries are evicted least-recently-used once the cache grows beyond max_bytes. Entries whose Document
+    is still held (e.g. by an open chat) and the entry being written are never evicted, so the cache can
+    exceed max_bytes while they are in use.
+    A (path, size, mtime) -> hash memo avoids rehashing files that didn't change.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        super().__init__(cache_dir, max_bytes)
+        # key -> Document handed out and still referenced somewhere, these entries are pinned
+        self._open_documents = weakref.WeakValueDictionary()
+
+    def _load_index(self):
+        index = super()._load_index()
+        index.setdefault("paths", {})
+        return index
+
+    def _pages_path(self, key):
+        return os.path.join(self.cache_dir, key + ".pages.json")
+
+    def _entry_files(self, key):
+        return [self._entry_path(key), self._pages_path(key)]
+
+    def _is_pinned(self, key):
+        return key in self._open_documents
+
+    def hash_for(self, file_path):
+        # Reuse the stored hash if the file wasn't touched since it was last hashed
+        stat = os.stat(file_path)
+        with self._lock:
+            memo = self._load_index()["paths"].get(os.path.abspath(file_path))
+        if memo and memo[0] == stat.st_size and memo[1] == stat.st_mtime:
+            return memo[2]
+        digest = file_hash(file_path)
+        with self._lock:
+            paths = self._load_index()["paths"]
+            # Re-inserted, so the memo is ordered from the least to the most recently hashed path
+            paths.pop(os.path.abspath(file_path), None)
+            paths[os.path.abspath(file_path)] = [stat.st_size, stat.st_mtime, digest]
+            for path in list(paths)[:max(0, len(paths) - MAX_PATH_MEMO)]:
+                del paths[path]
+            self._save_index()
+        return digest
+
+    def put_pages(self, key, pages):
+        """
+        Writes an iterable of page texts to the cache one page at a time and returns the Document.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = self._entry_path(key) + f".{threading.get_ident()}.tmp"
+        offsets = [0]
+        with open(tmp_path, "wb") as f:
+            for page in pages:
+                data = page.encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        with self._lock:
+            index = self._load_index()
+            with open(self._pages_path(key), "w", encoding="utf-8") as f:
+                json.dump(offsets, f)
+            os.replace(tmp_path, self._entry_path(key))
+            index["entries"][key] = {"size": offsets[-1], "last_used": time.time()}
+            self._evict(keep=key)
+            self._save_index()
+            return self._open_document(key, offsets)
+
+    def _open_document(self, key, offsets):
+        # One Document per entry, it pins the entry as long as anyone holds it
+        document = self._open_documents.get(key)
+        if document is None:
+            document = Document(self._entry_path(key), offsets)
+            self._open_documents[key] = document
+        return document
+
+    def get_document(self, key):
+        with self._lock:
+            index = self._load_index()
+            if key not in index["entries"]:
+                return None
+            try:
+                with open(self._pages_path(key), "r", encoding="utf-8") as f:
+                    offsets = json.load(f)
+            except (OSError, ValueError):
+                del index["entries"][key]
+                self._save_index()
+                return None
+            self._touch(key)
+            return self._open_document(key, offsets)
+
+    def get_or_extract(self, file_path, extract_pages, version, known_hash=None):
+        """
+        Returns (content hash, Document). On a miss, the pages yielded by extract_pages(file_path) are
+        written to the cache as they come. If known_hash is given and cached, the file isn't read at all,
+        so documents from a saved chat stay available even if they were moved or deleted in the meantime.
+        """
+        digest = known_hash if known_hash else self.hash_for(file_path)
+        key = f"{digest}-v{version}"
+        document = self.get_document(key)
+        if document is None:
+            if known_hash and not os.path.exists(file_path):
+                raise FileNotFoundError(file_path)
+            if known_hash:
+                digest = self.hash_for(file_path)
+                key = f"{digest}-v{version}"
+                document = self.get_document(key)
+            if document is None:
+                document = self.put_pages(key, extract_pages(file_path))
+        return digest, document
+
+
+extraction_cache = ExtractionCache()
@@ -0,0 +1,39 @@
+import time
+import threading
+
+# Imported first by main.py, so this is as close to the process start as Python code gets
+PROCESS_START = time.perf_counter()
+
+# The app is interactive once the window is drawn and both background startup jobs are done
+INTERACTIVE_AFTER = ("first_paint", "models_loaded", "chats_loaded")
+
+
+class StartupTimer:
+    """
+    Records the milliseconds from the process start to the startup milestones: imports done, window
+    connected, first paint, model list and sidebar loaded. "interactive" is recorded once all of
+    INTERACTIVE_AFTER happened; on_interactive(report) is called then, used by --benchmark-startup.
+    """
+
+    def __init__(self):
+        self.marks = {}
+        self.on_interactive = None
+        self._lock = threading.Lock()
+
+    def mark(self, name):
+        # Only the first occurrence counts, e.g. the sidebar is loaded again for every new session
+        with self._lock:
+            if name in self.marks:
+                return
+            self.marks[name] = round((time.perf_counter() - PROCESS_START) * 1000, 1)
+            done = "interactive" not in self.marks and all(mark in self.marks for mark in INTERACTIVE_AFTER)
+            if done:
+                self.marks["interactive"] = self.marks[name]
+        if done and self.on_interactive:
+            self.on_interactive(self.report())
+
+    def report(self):
+        return {"unit": "ms", **dict(sorted(self.marks.items(), key=lambda item: item[1]))}
+
+
+startup_timer = StartupTimer()
@@ -1,193 +1,177 @@
 import os
-import ollama
-import flet as ft
-import subprocess
-import sys
-import asyncio
-import httpx
-import fitz
 import re
-import pickle
-
-
-async def setup(page: ft.Page):
-    # Define alert dialog for setup process
-    status_text = ft.Text(value="Checking for Ollama installation...")
-    cancel_button = ft.TextButton("Cancel", on_click=lambda e: exit_program(page))
-
-    setup_dialog = ft.AlertDialog(
-        title=ft.Text("Setup in Progress"),
-        content=status_text,
-        actions=[cancel_button],
-        modal=True
-    )
-
-    page.dialog = setup_dialog
-    setup_dialog.open = True
-    page.update()
-
-    # Loop to check for ollama installation
-    while True:
-        #subprocess.run(["powershell.exe", "-Command", "ollama --version"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        try:
-            ollama.list()
-            status_text.value = "Ollama is installed."
-            page.update()
-            break  # Exit the loop if ollama is installed
-        except httpx.ConnectError as e:
-            # Show installation instructions if Ollama is not installed
-            status_text.value = "Ollama is not installed or not running. Please install it here:"
-            link = ft.Text("Ollama ",
-                           spans=[ft.TextSpan("Installation", url="https://ollama.com/download",
-                                              style=ft.TextStyle(decoration="underline", color="blue")), ])
-            setup_dialog.content = ft.Column([status_text, link])
-            page.update()
-
-        # Wait for 4 seconds before rechecking
-        await asyncio.sleep(4)
-
-    # Step 2: Check if llama3.2:latest is available
-    model_name = "llama3.2:latest"
-    available_models = [model['name'] for model in ollama.list()['models']]
-    if model_name not in available_models:
-        status_text.value = f"Ollama is installed, but {model_name} is missing. Downloading now... This may take a few minutes"
-        setup_dialog.content = ft.Column([status_text])
-        page.update()
-        try:
-            ollama.pull(model_name)  # Pull the model
-            status_text.value = f"Model '{model_name}' downloaded successfully!"
-        except Exception as e:
-            status_text.value = f"Failed to download model '{model_name}': {e}"
-    else:
-        status_text.value = f"'{model_name}' is already installed."
-        page.close(setup_dialog)
-
-    # Proceed with additional setup steps if necessary
-    status_text.value = "Setup completed successfully!"
-    setup_dialog.actions = [ft.TextButton("Close", on_click=lambda e: page.close(setup_dialog))]
-    page.update()
+
+from bot.client import get_client
+from bot.model_registry import model_registry
+from bot.metrics import format_metrics
+from utils.chat_store import get_store
+from utils.pdf_cache import extraction_cache
+from utils.ingestion import extract_pages, normalize_text, iter_pages, check_attachment, EXTRACTOR_VERSION
+
 
 def read_PDF(pdf_path):
-    text = ""
-    with fitz.open(pdf_path) as pdf:
-        for page_num in range(pdf.page_count):
-            page = pdf[page_num]
-            text += page.get_text("text")  # Extract text from each page
-    text = re.sub(r'\n+', '\n', text)
-    text = re.sub(r' +', ' ', text)
-    return text
+    # Pages are collected in a list and joined once, instead of growing one string page by page
+    return normalize_text("".join(extract_pages(pdf_path)))
+
+
+def read_document_cached(file_path, known_hash=None):
+    """
+    Extracts a PDF, plain-text or source file page by page into the content-addressed extraction cache.
+    Returns (content hash, Document), the text is read from disk when it's needed.
+    """
+    if not known_hash or os.path.exists(file_path):
+        check_attachment(file_path)
+    return extraction_cache.get_or_extract(file_path, iter_pages, EXTRACTOR_VERSION, known_hash)
 
-def store_submitted_files(file_paths, filename):
+
+def store_submitted_files(file_paths, chat_name, file_hashes=None, chat_folder="saved_chats"):
     """
-    The path of files that are still active in this chat are stored. When the chat is activated again,
-    the files will be loaded. When the file is not available anymore, the path will be deleted.
+    The files that are still active in this chat are stored with their content hash. When the chat is
+    activated again, the extracted text is taken from the extraction cache by hash, so the documents
+    don't have to be parsed again.
     """
+    file_hashes = file_hashes or {}
+    entries = [{"path": path, "hash": file_hashes.get(path)} for path in file_paths]
+    get_store(chat_folder).set_attachments(chat_name, entries)
+
 
-    with open(os.path.join("saved_chats", filename+".pkl"), "wb") as f:
-        pickle.dump(file_paths, f)
+def load_submitted_files(chat_name, chat_folder="saved_chats"):
+    """
+    Loads the attachments of a chat as a list of {"path", "hash"} entries. Entries are dropped when the
+    file isn't available anymore and its text isn't in the extraction cache either.
+    """
+    return [
+        entry for entry in get_store(chat_folder).get_attachments(chat_name)
+        if os.path.exists(entry["path"])
+        or (entry["hash"] and extraction_cache.contains(f"{entry['hash']}-v{EXTRACTOR_VERSION}"))
+    ]
+
+
+def save_chat_summary(chat_name, summary, message_count, chat_folder="saved_chats"):
+    get_store(chat_folder).set_summary(chat_name, summary, message_count)
+
+
+def load_chat_summary(chat_name, chat_folder="saved_chats"):
+    """
+    Returns the rolling summary of a chat as {"content", "message_count"}, or None.
+    """
+    return get_store(chat_folder).get_summary(chat_name)
 
 
-def load_submitted_files(file_path):
+def sanitize_chat_name(name, max_length=60):
     """
-    Loads file paths from a pickle file if it exists. If the file does not exist,
-    returns an empty list. Also filters out any paths in the list that are no longer
-    available on the filesystem.
+    Makes a chat title usable as a file name on every OS.
     """
+    name = re.sub(r'[<>:"/\\|?*\x00-\x1f]', ' ', name.strip().splitlines()[0] if name.strip() else "")
+    name = re.sub(r'\s+', ' ', name)[:max_length]
+    return name.strip(" .")
+
 
-    # Check if the file exists
-    if not os.path.exists(file_path):
-        return []
+def provisional_chat_name(messages):
+    # First words of the first prompt, used until the generated title arrives
+    prompt = next((message['content'] for message in messages if message['role'] == 'user'), "")
+    name = sanitize_chat_name(" ".join(prompt.split()[:6]), max_length=40)
+    return name or "New chat"
 
-    with open(file_path, "rb") as f:
-        file_paths = pickle.load(f)
 
-    # Filter out paths that no longer exist
-    valid_file_paths = [path for path in file_paths if os.path.exists(path)]
+def unique_chat_name(name, chat_folder="saved_chats"):
+    store = get_store(chat_folder)
+    candidate = name
+    counter = 2
+    while store.chat_exists(candidate):
+        candidate = f"{name} ({counter})"
+        counter += 1
+    return candidate
 
-    return valid_file_paths
 
+def rename_chat(old_name, new_name, chat_folder="saved_chats"):
+    """
+    Renames a chat and its vector index. Returns the name that was used, which gets a counter
+    if new_name is taken.
+    """
+    new_name = unique_chat_name(new_name, chat_folder)
+    get_store(chat_folder).rename_chat(old_name, new_name)
+    old_index_path = chat_index_path(old_name, chat_folder)
+    if os.path.exists(old_index_path):
+        os.replace(old_index_path, chat_index_path(new_name, chat_folder))
+    return new_name
 
-def exit_program(page):
-    # Close the dialog and exit the program
-    page.dialog.open = False
-    page.update()
-    sys.exit()
 
+def chat_index_path(chat_name, chat_folder="saved_chats"):
+    # Vector index of the chat's documents, used in retrieval mode
+    return os.path.join(chat_folder, chat_name + ".index.npz")
 
 
 def load_chat_files(chat_folder="saved_chats"):
     """
-    Load chat files from a specified directory and return a sorted list of filenames.
+    Returns the names of all saved chats, most recently updated first.
+    """
+    return get_store(chat_folder).list_chats()
+
+
+def load_chat_entries(offset=0, limit=None, chat_folder="saved_chats"):
+    """
+    Returns one page of the sidebar index: name, last update, message count and preview of each chat.
     """
-    if not os.path.exists(chat_folder):
-        os.makedirs(chat_folder)
+    return get_store(chat_folder).list_chat_entries(offset, limit)
 
-    # List and sort .txt files by modification date
-    chat_files = [f for f in os.listdir(chat_folder) if f.endswith(".txt")]
-    chat_files = sorted(chat_files, key=lambda f: os.path.getmtime(os.path.join(chat_folder, f)), reverse=True)
-    return chat_files
 
+def load_chat_entry(chat_name, chat_folder="saved_chats"):
+    return get_store(chat_folder).get_chat_entry(chat_name)
 
-def format_chat_content(file_path):
+
+def search_chats(query, limit=50, chat_folder="saved_chats"):
     """
-    Reads a chat file and formats it for display in Markdown.
+    Full-text search over all saved messages, best match first.
     """
-    chat_content = ""
-    with open(file_path, "r", encoding="utf-8") as file:
-        current_role = None
-        current_message = []
+    return get_store(chat_folder).search(query, limit)
+
 
-        for line in file:
-            if line.startswith("user: "):
-                if current_message:
-                    chat_content += f"**{current_role.capitalize()}:**\n" + "\n".join(current_message) + "\n\n"
-                    current_message = []
-                current_role = "user"
-                current_message.append(line[len("user: "):].strip())
-            elif line.startswith("assistant: "):
-                if current_message:
-                    chat_content += f"**{current_role.capitalize()}:**\n" + "\n".join(current_message) + "\n\n"
-                    current_message = []
-                current_role = "assistant"
-                current_message.append(line[len("assistant: "):].strip())
-            else:
-                current_message.append(line.rstrip())
+def format_messages(messages):
+    """
+    Formats messages for display in Markdown. Answers with recorded metrics get them as a footer line.
+    """
+    return "".join(f"**{message['role'].capitalize()}:**\n{message['content']}\n\n"
+                   + metrics_footer((message.get('meta') or {}).get('metrics')) for message in messages)
 
-        if current_message:
-            chat_content += f"**{current_role.capitalize()}:**\n" + "\n".join(current_message) + "\n\n"
 
-    return chat_content
+def metrics_footer(metrics):
+    footer = format_metrics(metrics) if metrics else ""
+    return f"*{footer}*\n\n" if footer else ""
 
-def save_chat_entry(chat_name, unsaved_text):
+
+def format_chat_content(chat_name, chat_folder="saved_chats"):
     """
-    saves chat to .txt file
+    Reads a chat and formats it for display in Markdown.
     """
-    file_path = os.path.join("saved_chats", chat_name + ".txt")
-    for entry in unsaved_text:
-        with open(file_path, "a", encoding="utf-8") as file:
-            file.write(f"{entry['role']}: {entry['content']}\n")
+    return format_messages(load_chat_file(chat_name, chat_folder))
 
 
-def load_chat_file(file_path):
+def save_chat_entry(chat_name, unsaved_text, chat_folder="saved_chats"):
     """
-    Generator function to read chat lines from a file.
-    Yields a dictionary with 'role' and 'content' for each line.
+    Saves the new messages of a chat in one transaction.
     """
+    if unsaved_text:
+        get_store(chat_folder).append_messages(chat_name, unsaved_text)
 
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Chat file '{file_path}' not found.")
 
-    with open(file_path, "r", encoding="utf-8") as file:
-        for line in file:
-            if line.startswith("user: "):
-                yield {"role": "user", "content": line[len("user: "):].strip()}
-            elif line.startswith("assistant: "):
-                yield {"role": "assistant", "content": line[len("assistant: "):].strip()}
+def load_chat_file(chat_name, chat_folder="saved_chats", start=0, end=None):
+    """
+    Returns the messages [start, end) of a chat as dictionaries with 'role' and 'content'.
+    """
+    store = get_store(chat_folder)
+    if not store.chat_exists(chat_name):
+        raise FileNotFoundError(f"Chat '{chat_name}' not found.")
+    return store.load_messages(chat_name, start, end)
 
 def delete_models(e):
     for model_name in e:
-        ollama.delete(model_name)
+        get_client().sync.delete(model_name)
+    # Listeners (dropdown, manage-models dialog) are notified with the new list
+    model_registry.refresh_sync(force=True)
 
-def delete_chat(e):
+def delete_chat(e, chat_folder="saved_chats"):
     for name in e:
-        os.remove(os.path.join("saved_chats", name+".txt"))
+        get_store(chat_folder).delete_chat(name)
+        if os.path.exists(chat_index_path(name, chat_folder)):
+            os.remove(chat_index_path(name, chat_folder))